@@ -0,0 +1,168 @@
+import asyncio
+import gzip
+import hashlib
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from bson import Binary, json_util
+from pymongo import ReplaceOne
+from config import LOGGER, BACKUP_SEGMENT_BYTES, BACKUP_RESTORE_BATCH
+from database import (users_collection, channels_collection, admins_collection, broadcasts_collection,
+                      settings_collection, fsub_collection, links_collection, backup_collection,
+                      backup_chunks_collection)
+
+logger = LOGGER(__name__)
+
+BACKUP_COLLECTIONS = {
+    c.name: c for c in (users_collection, channels_collection, admins_collection, broadcasts_collection,
+                        settings_collection, fsub_collection, links_collection)
+}
+
+# ========== STREAMING BACKUP ==========
+# A backup is a manifest in backup_collection plus gzip-compressed NDJSON
+# segments in backup_chunks_collection. Each segment holds at most
+# BACKUP_SEGMENT_BYTES of raw JSON and its SHA-256, so memory stays bounded by
+# one segment no matter how large a collection gets.
+
+def _pack(raw: bytes) -> Dict:
+    data = gzip.compress(raw, compresslevel=6)
+    return {'data': Binary(data), 'sha256': hashlib.sha256(data).hexdigest(),
+            'raw_bytes': len(raw), 'bytes': len(data)}
+
+def _unpack(chunk: Dict) -> List[bytes]:
+    data = bytes(chunk['data'])
+    if hashlib.sha256(data).hexdigest() != chunk['sha256']:
+        raise ValueError(f"Checksum mismatch in backup segment {chunk['_id']}")
+    return gzip.decompress(data).splitlines()
+
+async def _write_segment(backup_id: str, collection: str, seq: int, lines: List[bytes]) -> Dict:
+    packed = await asyncio.to_thread(_pack, b'\n'.join(lines))
+    await backup_chunks_collection.insert_one({
+        '_id': f"{backup_id}:{collection}:{seq:06d}",
+        'backup_id': backup_id,
+        'collection': collection,
+        'seq': seq,
+        'rows': len(lines),
+        **packed
+    })
+    return packed
+
+async def _dump_collection(backup_id: str, name: str) -> Dict:
+    info = {'rows': 0, 'segments': 0, 'bytes': 0, 'raw_bytes': 0}
+    lines, size = [], 0
+    async for doc in BACKUP_COLLECTIONS[name].reads.find({}).batch_size(1000):
+        line = json_util.dumps(doc).encode()
+        lines.append(line)
+        size += len(line) + 1
+        if size >= BACKUP_SEGMENT_BYTES:
+            packed = await _write_segment(backup_id, name, info['segments'], lines)
+            info['segments'] += 1
+            info['rows'] += len(lines)
+            info['bytes'] += packed['bytes']
+            info['raw_bytes'] += packed['raw_bytes']
+            lines, size = [], 0
+    if lines:
+        packed = await _write_segment(backup_id, name, info['segments'], lines)
+        info['segments'] += 1
+        info['rows'] += len(lines)
+        info['bytes'] += packed['bytes']
+        info['raw_bytes'] += packed['raw_bytes']
+    return info
+
+async def create_stream_backup(collections: List[str] = None) -> str:
+    """Stream collections into compressed NDJSON segments, return the backup ID"""
+    # Random suffix so two backups started in the same second don't collide
+    backup_id = f"backup_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+    names = collections or list(BACKUP_COLLECTIONS)
+    try:
+        await backup_collection.insert_one({
+            '_id': backup_id,
+            'format': 'ndjson.gz',
+            'status': 'running',
+            'created_at': datetime.utcnow(),
+            'collections': {}
+        })
+    except Exception as e:
+        logger.error(f"Backup {backup_id} could not be started: {e}")
+        return ""
+
+    started = time.monotonic()
+    manifest = {}
+    try:
+        for name in names:
+            manifest[name] = await _dump_collection(backup_id, name)
+            logger.info(f"Backup {backup_id}: {name} {manifest[name]['rows']} rows "
+                        f"in {manifest[name]['segments']} segments")
+    except Exception as e:
+        logger.error(f"Backup {backup_id} failed: {e}")
+        await backup_collection.update_one({'_id': backup_id}, {'$set': {'status': 'failed', 'error': str(e)}})
+        await backup_chunks_collection.delete_many({'backup_id': backup_id})
+        return ""
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    rows = sum(info['rows'] for info in manifest.values())
+    await backup_collection.update_one({'_id': backup_id}, {'$set': {
+        'status': 'complete',
+        'collections': manifest,
+        'rows': rows,
+        'size': sum(info['bytes'] for info in manifest.values()),
+        'duration': round(elapsed, 2),
+        'rows_per_sec': round(rows / elapsed, 1)
+    }})
+    logger.info(f"Backup {backup_id} complete: {rows} rows, {rows / elapsed:.0f} rows/sec")
+    return backup_id
+
+# ========== RESTORE ==========
+async def restore_backup(backup_id: str, collections: List[str] = None) -> Dict:
+    """Upsert every document from a backup, verifying segment checksums"""
+    manifest = await backup_collection.find_one({'_id': backup_id})
+    if not manifest or manifest.get('status') != 'complete':
+        raise ValueError(f"Backup {backup_id} not found or incomplete")
+
+    started = time.monotonic()
+    restored = {}
+    for name in collections or list(manifest['collections']):
+        if name not in BACKUP_COLLECTIONS:
+            continue
+        target = BACKUP_COLLECTIONS[name]
+        rows = 0
+        cursor = backup_chunks_collection.find({'backup_id': backup_id, 'collection': name}).sort('seq', 1).batch_size(1)
+        async for chunk in cursor:
+            lines = await asyncio.to_thread(_unpack, chunk)
+            for start in range(0, len(lines), BACKUP_RESTORE_BATCH):
+                docs = [json_util.loads(line) for line in lines[start:start + BACKUP_RESTORE_BATCH]]
+                await target.bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in docs],
+                                        ordered=False)
+                rows += len(docs)
+        restored[name] = rows
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    total = sum(restored.values())
+    logger.info(f"Restored {total} rows from {backup_id} at {total / elapsed:.0f} rows/sec")
+    return {'collections': restored, 'rows': total, 'duration': round(elapsed, 2),
+            'rows_per_sec': round(total / elapsed, 1)}
+
+# ========== BACKUP LISTING ==========
+async def list_backups(limit: int = 10) -> List[Dict]:
+    """Get the most recent backup manifests"""
+    try:
+        return await backup_collection.find({}, {'data': 0}).sort('created_at', -1).limit(limit).to_list(None)
+    except:
+        return []
+
+async def delete_backup(backup_id: str) -> bool:
+    """Delete a backup manifest and its segments"""
+    try:
+        await backup_chunks_collection.delete_many({'backup_id': backup_id})
+        result = await backup_collection.delete_one({'_id': backup_id})
+        return result.deleted_count > 0
+    except:
+        return False
+
+async def get_backup(backup_id: str) -> Optional[Dict]:
+    """Get a backup manifest"""
+    try:
+        return await backup_collection.find_one({'_id': backup_id}, {'data': 0})
+    except:
+        return None
@@ -0,0 +1,315 @@
+"""Offline micro-benchmarks for helper_func.py and database.py.
+
+Usage:
+    python benchmarks/bench.py run [--sizes 1000,10000,100000,1000000]
+                                   [--db mongomock|URI] [--db-sizes 1000,10000]
+                                   [--logging 10,100] [--output results.json]
+    python benchmarks/bench.py compare old.json new.json
+
+Pure helpers always run. Database benchmarks run when --db is given: either
+"mongomock" (needs the mongomock-motor package) or the URI of a local
+mongod, which is used with a throwaway database. Results are JSON with
+ops/sec and p50/p99 per operation, so two runs can be diffed.
+
+The logging benchmarks log in bursts while a second task measures how late
+1 ms sleeps wake up; their p50/p99 are that event-loop stall, not per-call
+time, for a file handler called directly versus the queue pipeline.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# database.py needs a URI to import; nothing connects unless --db points at a server
+os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+
+BATCHES = 50
+
+def _percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+def _result(name: str, size: int, per_op: List[float]) -> Dict:
+    return {
+        'name': name,
+        'size': size,
+        'ops_per_sec': round(1 / statistics.mean(per_op), 1),
+        'p50_us': round(_percentile(per_op, 50) * 1e6, 3),
+        'p99_us': round(_percentile(per_op, 99) * 1e6, 3),
+        'samples': len(per_op)
+    }
+
+def bench_sync(name: str, size: int, fn: Callable[[], object], min_time: float = 0.2) -> Dict:
+    """Time fn in batches sized so each batch takes ~min_time / BATCHES"""
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        if time.perf_counter() - started >= min_time / BATCHES or calls >= 1 << 20:
+            break
+        calls *= 2
+    per_op = []
+    for _ in range(BATCHES):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        per_op.append((time.perf_counter() - started) / calls)
+    return _result(name, size, per_op)
+
+async def bench_async(name: str, size: int, fn: Callable[[], object], iterations: int = 200) -> Dict:
+    """Time each awaited call individually"""
+    per_op = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        per_op.append(time.perf_counter() - started)
+    return _result(name, size, per_op)
+
+def _random_name(rng: random.Random) -> str:
+    return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+                    for _ in range(rng.randint(1, 4)))
+
+# ========== PURE HELPERS ==========
+def run_helper_benchmarks(sizes: List[int]) -> List[Dict]:
+    from helper_func import (encode_string, decode_string, encode_link_token, decode_link_token,
+                             _verify_link_token, parse_time_string, paginate_list, is_valid_url)
+    from search_index import ChannelSearchIndex
+
+    results = []
+    token = encode_string("get-1001234567890-normal")
+    results.append(bench_sync('helper.encode_string', 1, lambda: encode_string("get-1001234567890-normal")))
+    results.append(bench_sync('helper.decode_string', 1, lambda: decode_string(token)))
+    link_token = encode_link_token(-1001234567890, 'request', int(time.time()) + 3600)
+    forged = link_token[:-2] + ('AA' if link_token[-2:] != 'AA' else 'BB')
+    results.append(bench_sync('helper.encode_link_token', 1,
+                              lambda: encode_link_token(-1001234567890, 'request', 4102444800)))
+    results.append(bench_sync('helper.decode_link_token', 1, lambda: decode_link_token(link_token)))
+    results.append(bench_sync('helper.decode_link_token_uncached', 1,
+                              lambda: _verify_link_token.__wrapped__(link_token)))
+    results.append(bench_sync('helper.decode_link_token_forged', 1,
+                              lambda: _verify_link_token.__wrapped__(forged)))
+    results.append(bench_sync('helper.parse_time_string', 1, lambda: parse_time_string("1D 2H 30M 15S")))
+    results.append(bench_sync('helper.is_valid_url', 1, lambda: is_valid_url("https://t.me/+AbCdEfGhIjKlMnOp")))
+
+    rng = random.Random(42)
+    for size in sizes:
+        items = list(range(size))
+        middle = size // 20
+        results.append(bench_sync('helper.paginate_list', size, lambda: paginate_list(items, middle)))
+
+        index = ChannelSearchIndex()
+        index.build({'_id': -i, 'anime_name': _random_name(rng)} for i in range(size))
+        queries = [index._names[-rng.randrange(size)][:12] for _ in range(64)]
+        position = [0]
+
+        def search():
+            position[0] = (position[0] + 1) % len(queries)
+            index.search(queries[position[0]], limit=10)
+        results.append(bench_sync('search_index.search', size, search))
+    return results
+
+# ========== LOGGING ==========
+async def _measure_stall(logger: logging.Logger, burst: int, duration: float) -> Dict:
+    lags = []
+    logged = 0
+    stop = time.perf_counter() + duration
+
+    async def monitor():
+        while time.perf_counter() < stop:
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append(max(time.perf_counter() - expected, 0.0))
+
+    async def emit():
+        # A burst every 5 ms, like a busy handler pool
+        nonlocal logged
+        while time.perf_counter() < stop:
+            for i in range(burst):
+                logger.info("user %d got link for channel %d: %s", i, -1001234567890, "x" * 60)
+            logged += burst
+            await asyncio.sleep(0.005)
+
+    started = time.perf_counter()
+    await asyncio.gather(monitor(), emit())
+    result = _result('', burst, lags)
+    result['ops_per_sec'] = round(logged / (time.perf_counter() - started), 1)
+    result['max_us'] = round(max(lags) * 1e6, 3)
+    return result
+
+def run_logging_benchmarks(bursts: List[int], duration: float = 2.0) -> List[Dict]:
+    from logging.handlers import RotatingFileHandler, QueueListener
+    from config import LoopQueueHandler
+    import queue
+
+    results = []
+    formatter = logging.Formatter("[%(asctime)s - %(levelname)s] - %(name)s - %(message)s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for burst in bursts:
+            for mode in ('direct', 'queue'):
+                # Small files so rotation happens during the run, as it does in production
+                file_handler = RotatingFileHandler(os.path.join(tmp, f"{mode}.log"), maxBytes=1000000, backupCount=2)
+                file_handler.setFormatter(formatter)
+                logger = logging.getLogger(f"bench.logging.{mode}.{burst}")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                listener = None
+                if mode == 'direct':
+                    logger.addHandler(file_handler)
+                else:
+                    log_queue = queue.SimpleQueue()
+                    logger.addHandler(LoopQueueHandler(log_queue))
+                    listener = QueueListener(log_queue, file_handler)
+                    listener.start()
+                result = asyncio.run(_measure_stall(logger, burst, duration))
+                result['name'] = f"logging.{mode}_loop_stall"
+                results.append(result)
+                if listener:
+                    listener.stop()
+                logger.handlers.clear()
+                file_handler.close()
+    return results
+
+# ========== DATABASE ==========
+async def _use_backend(database, db: str):
+    """Point database.py at the benchmark backend"""
+    if db == 'mongomock':
+        from mongomock_motor import AsyncMongoMockClient
+        target = AsyncMongoMockClient()['bench']
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        target = AsyncIOMotorClient(db)[f"bench_{os.getpid()}"]
+    database.use_database(target)
+    return target
+
+async def _seed(database, size: int):
+    rng = random.Random(size)
+    await database.users_collection.delete_many({})
+    await database.channels_collection.delete_many({})
+    for start in range(0, size, 10000):
+        end = min(start + 10000, size)
+        await database.users_collection.insert_many(
+            [{'_id': i, 'username': f"user{i}", 'joined_at': datetime.utcnow()} for i in range(start, end)])
+        await database.channels_collection.insert_many(
+            [{'_id': -1000000000000 - i, 'anime_name': _random_name(rng), 'status': 'active'}
+             for i in range(start, end)])
+
+async def run_db_benchmarks(db: str, sizes: List[int]) -> List[Dict]:
+    import database
+
+    target = await _use_backend(database, db)
+    results = []
+    try:
+        for size in sizes:
+            await _seed(database, size)
+            await database.load_admin_cache()
+            await database.load_settings_cache()
+            await database.load_channel_index()
+            rng = random.Random(size)
+            sample_name = next(iter(database.channel_index._docs.values()))['anime_name']
+
+            results.append(await bench_async('db.get_user', size,
+                                             lambda: database.get_user(rng.randrange(size))))
+            results.append(await bench_async('db.count_users', size, database.count_users, 20))
+            results.append(await bench_async('db.is_admin', size,
+                                             lambda: database.is_admin(rng.randrange(size))))
+            results.append(await bench_async('db.get_setting', size,
+                                             lambda: database.get_setting('force_sub_enabled')))
+            results.append(await bench_async('db.get_channel_by_name', size,
+                                             lambda: database.get_channel_by_name(sample_name)))
+            results.append(await bench_async('db.get_channels_page', size,
+                                             lambda: database.get_channels_page(limit=10), 50))
+            results.append(await bench_async('db.get_stats', size, database.get_stats, 50))
+
+            if db == 'mongomock':
+                # mongomock's bulk_write doesn't accept current pymongo UpdateOne ops
+                continue
+
+            async def add_and_flush():
+                for i in range(100):
+                    await database.add_user(size + rng.randrange(size), 'bench')
+                await database.flush_users()
+            results.append(await bench_async('db.add_user_x100_flush', size, add_and_flush, 20))
+    finally:
+        if db != 'mongomock':
+            await target.client.drop_database(target.name)
+    return results
+
+# ========== CLI ==========
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+def run(args) -> Dict:
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = run_helper_benchmarks(sizes)
+    if args.logging:
+        results += run_logging_benchmarks([int(b) for b in args.logging.split(',')])
+    if args.db:
+        db_sizes = [int(s) for s in args.db_sizes.split(',')]
+        results += asyncio.run(run_db_benchmarks(args.db, db_sizes))
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'db': 'mongomock' if args.db == 'mongomock' else ('mongod' if args.db else None),
+            'created_at': datetime.utcnow().isoformat()
+        },
+        'results': results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return report
+
+def compare(args):
+    with open(args.old) as f:
+        old = {(r['name'], r['size']): r for r in json.load(f)['results']}
+    with open(args.new) as f:
+        new = json.load(f)['results']
+    print(f"{'benchmark':<32} {'size':>9} {'old ops/s':>12} {'new ops/s':>12} {'change':>8}  p99 old→new (µs)")
+    for result in new:
+        before = old.get((result['name'], result['size']))
+        if not before:
+            continue
+        change = (result['ops_per_sec'] / before['ops_per_sec'] - 1) * 100
+        print(f"{result['name']:<32} {result['size']:>9} {before['ops_per_sec']:>12} "
+              f"{result['ops_per_sec']:>12} {change:>+7.1f}%  {before['p99_us']}→{result['p99_us']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run')
+    run_parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    run_parser.add_argument('--db', help="'mongomock' or a mongodb:// URI of a local server")
+    run_parser.add_argument('--db-sizes', default='1000,10000')
+    run_parser.add_argument('--logging', metavar='BURSTS', help="log lines per burst, e.g. 10,100")
+    run_parser.add_argument('--output')
+    compare_parser = sub.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    args = parser.parse_args()
+    run(args) if args.command == 'run' else compare(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+import asyncio
+import secrets
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Coroutine, Dict, List, Optional, Set, Tuple
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid
+from config import (LOGGER, INSTANCE_ID, BROADCAST_WORKERS, BROADCAST_BATCH_SIZE,
+                    BROADCAST_CHECKPOINT_INTERVAL, BROADCAST_DELETE_BATCH)
+from database import (iter_user_ids, save_broadcast, get_broadcast, update_broadcast_progress,
+                      get_running_broadcasts, get_scheduled_broadcasts, claim_scheduled_broadcast,
+                      save_broadcast_messages, iter_broadcast_messages, get_broadcasts_to_delete,
+                      claim_broadcast_deletion, mark_broadcast_deleted, broadcast_fenced_out)
+from lease import Lease
+from ratelimit import set_api_lane
+from scheduler import DeadlineScheduler, delete_chat_messages
+
+logger = LOGGER(__name__)
+
+ProgressCallback = Callable[[Dict], Awaitable[None]]
+
+# Tries at writing a finished broadcast's last messages and status
+FINAL_WRITE_ATTEMPTS = 3
+
+# Bots can delete their messages in private chats for this long only
+PRIVATE_DELETE_WINDOW = timedelta(hours=48)
+
+# Sends, deletions and resumed broadcasts run detached from whoever started
+# them; keep a reference so they aren't garbage collected mid-run.
+_running: Set[asyncio.Task] = set()
+
+def _spawn(coro: Coroutine, what: str) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _running.add(task)
+    task.add_done_callback(lambda done: _task_done(done, what))
+    return task
+
+def _task_done(task: asyncio.Task, what: str):
+    _running.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"{what} failed: {task.exception()!r}")
+
+# ========== BROADCAST ENGINE ==========
+class BroadcastEngine:
+    """Copy one message to every user, streaming IDs and checkpointing progress.
+
+    User IDs are read in ascending order from a projected cursor and handed to a
+    fixed pool of workers. The checkpoint stores the highest ID below which every
+    user has been handled, so a restart resumes from there. Users finished out of
+    order above that mark (at most the queue size plus the worker count) may
+    receive the message again after a crash.
+    """
+
+    def __init__(self, client, broadcast_id: str, from_chat_id: int, message_id: int,
+                 workers: int = BROADCAST_WORKERS, on_progress: ProgressCallback = None,
+                 record_messages: bool = False):
+        self.client = client
+        self.broadcast_id = broadcast_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.workers = workers
+        self.on_progress = on_progress
+        self.record_messages = record_messages
+        self.stats = {'sent': 0, 'failed': 0, 'blocked': 0}
+        self.last_id = None
+        self.completed = False
+        self._sent_messages: List[Tuple[int, int]] = []
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+        self._dispatched = deque()
+        self._finished = set()
+        self._resume_at = 0.0
+        self._started = 0.0
+        self._done_at_start = 0
+        self._lease: Optional[Lease] = None
+        self._token: Optional[int] = None
+        self._lost = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def processed(self) -> int:
+        return self.stats['sent'] + self.stats['failed'] + self.stats['blocked']
+
+    def progress(self) -> Dict:
+        """Current counters, checkpoint and throughput"""
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        return {
+            **self.stats,
+            'last_id': self.last_id,
+            'elapsed': round(elapsed, 1),
+            'rate': round((self.processed - self._done_at_start) / elapsed, 1)
+        }
+
+    async def run(self, resume: Dict = None, lease: Lease = None) -> Optional[Dict]:
+        """Send to all users after the checkpoint in `resume`, return final progress.
+
+        Pass `lease` if the caller already holds the broadcast's lease.
+        """
+        # Only one instance may send a given broadcast
+        lease = lease or Lease(f"broadcast:{self.broadcast_id}")
+        if not lease.is_held and not await lease.try_acquire():
+            logger.info(f"Broadcast {self.broadcast_id} is being sent by another instance")
+            return None
+        lease.start()
+        self._lease, self._token = lease, lease.token
+
+        if resume:
+            self.last_id = resume.get('last_id')
+            for key in self.stats:
+                self.stats[key] = resume.get(key, 0)
+            logger.info(f"Resuming broadcast {self.broadcast_id} after user {self.last_id}")
+        self._started = time.monotonic()
+        self._done_at_start = self.processed
+
+        if await self._checkpoint(self.progress(), status='running') is False:
+            logger.info(f"Broadcast {self.broadcast_id} was taken over by a newer lease holder")
+            await lease.stop()
+            return None
+        feeder = asyncio.create_task(self._feed())
+        self._tasks = [feeder] + [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report())
+        try:
+            # Returns early only if the feeder fails; _lose() cancels everything
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            reporter.cancel()
+            for task in self._tasks:
+                task.cancel()
+        if not feeder.cancelled() and feeder.exception():
+            await self._save_sent_messages()
+            await lease.stop()
+            raise feeder.exception()
+
+        # Messages already sent are recorded even if we lost the lease
+        for attempt in range(FINAL_WRITE_ATTEMPTS):
+            if await self._save_sent_messages():
+                break
+            await asyncio.sleep(attempt + 1)
+        else:
+            logger.error(f"Broadcast {self.broadcast_id}: {len(self._sent_messages)} sent messages "
+                         f"could not be recorded and won't be auto-deleted")
+        progress = self.progress()
+        written = None
+        for attempt in range(FINAL_WRITE_ATTEMPTS):
+            if not self._holds_lease():
+                break
+            written = await self._checkpoint(progress, status='sent')
+            if written is not None:
+                break
+            await asyncio.sleep(attempt + 1)
+        if not written:
+            # Another instance has taken over (or will, once our lease expires)
+            # and resumes from the last checkpoint
+            logger.warning(f"Lost lease on broadcast {self.broadcast_id}, stopping")
+            await lease.stop()
+            return progress
+        await lease.stop()
+        self.completed = True
+        if self.on_progress:
+            await self.on_progress(progress)
+        logger.info(f"Broadcast {self.broadcast_id} finished: {progress}")
+        return progress
+
+    def _holds_lease(self) -> bool:
+        return not self._lost and self._lease.is_held and self._lease.token == self._token
+
+    def _lose(self):
+        """Stop sending at once; a newer lease holder owns the broadcast"""
+        self._lost = True
+        for task in self._tasks:
+            task.cancel()
+
+    async def _feed(self):
+        async for user_id in iter_user_ids(self.last_id, BROADCAST_BATCH_SIZE):
+            if not self._holds_lease():
+                self._lose()
+                return
+            self._dispatched.append(user_id)
+            await self._queue.put(user_id)
+        for _ in range(self.workers):
+            await self._queue.put(None)
+
+    async def _worker(self):
+        set_api_lane('broadcast')
+        while True:
+            user_id = await self._queue.get()
+            if user_id is None:
+                return
+            if not self._holds_lease():
+                self._lose()
+                return
+            self.stats[await self._send(user_id)] += 1
+            self._finish(user_id)
+
+    async def _send(self, user_id: int) -> str:
+        while True:
+            # A FloodWait seen by any worker pauses the whole pool
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                message = await self.client.copy_message(user_id, self.from_chat_id, self.message_id)
+                if self.record_messages:
+                    self._sent_messages.append((user_id, message.id))
+                return 'sent'
+            except FloodWait as e:
+                self._resume_at = max(self._resume_at, time.monotonic() + e.value + 1)
+            except (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid):
+                return 'blocked'
+            except Exception:
+                return 'failed'
+
+    def _finish(self, user_id: int):
+        self._finished.add(user_id)
+        while self._dispatched and self._dispatched[0] in self._finished:
+            self.last_id = self._dispatched.popleft()
+            self._finished.discard(self.last_id)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+            await self._save_sent_messages()
+            progress = self.progress()
+            if not self._holds_lease() or await self._checkpoint(progress) is False:
+                self._lose()
+                return
+            logger.info(f"Broadcast {self.broadcast_id}: {progress['sent']} sent, "
+                        f"{progress['rate']} msgs/sec")
+            if self.on_progress:
+                try:
+                    await self.on_progress(progress)
+                except Exception as e:
+                    logger.warning(f"Broadcast progress callback failed: {e}")
+
+    async def _checkpoint(self, progress: Dict, status: str = None) -> Optional[bool]:
+        """Write progress under our lease token.
+
+        True if written, False if a newer lease holder has written since
+        (we are fenced out), None if the write itself failed.
+        """
+        if await update_broadcast_progress(self.broadcast_id, progress, status=status, lease_token=self._token):
+            return True
+        if await broadcast_fenced_out(self.broadcast_id, self._token):
+            return False
+        logger.warning(f"Could not checkpoint broadcast {self.broadcast_id}")
+        return None
+
+    async def _save_sent_messages(self) -> bool:
+        messages, self._sent_messages = self._sent_messages, []
+        if await save_broadcast_messages(self.broadcast_id, messages):
+            return True
+        # Keep them for the next attempt, or they would never be deleted
+        self._sent_messages[:0] = messages
+        return False
+
+# ========== BROADCAST DISPATCHER ==========
+class BroadcastDispatcher:
+    """Start scheduled broadcasts on time and delete their messages afterwards.
+
+    Upcoming sends and deletions share one DeadlineScheduler keyed by
+    ('send' | 'delete', broadcast_id). Every instance loads the same work; an
+    atomic claim in Mongo decides which one actually does it. Each broadcast's
+    messages are grouped per chat so a chat gets one delete_messages call.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.scheduler = DeadlineScheduler(self._handle_due, name="broadcast-dispatcher")
+        self._semaphore = asyncio.Semaphore(BROADCAST_WORKERS)
+        self._callbacks: Dict[str, ProgressCallback] = {}
+        self.deleted = 0
+
+    async def start(self) -> int:
+        """Load scheduled sends and pending deletions, then start the scheduler"""
+        await self.refresh()
+        self.scheduler.start()
+        return len(self.scheduler)
+
+    async def stop(self):
+        await self.scheduler.stop()
+
+    async def refresh(self) -> int:
+        """Schedule work saved by other instances; returns how many items were new"""
+        added = 0
+        for broadcast in await get_scheduled_broadcasts():
+            if ('send', broadcast['_id']) not in self.scheduler:
+                self.scheduler.schedule(('send', broadcast['_id']), broadcast['scheduled_for'])
+                added += 1
+        for broadcast in await get_broadcasts_to_delete():
+            if ('delete', broadcast['_id']) not in self.scheduler and broadcast.get('sent_at'):
+                self.schedule_delete(broadcast['_id'],
+                                     broadcast['sent_at'] + timedelta(seconds=broadcast['delete_after']))
+                added += 1
+        return added
+
+    def schedule_send(self, broadcast_id: str, scheduled_for: datetime, on_progress: ProgressCallback = None):
+        if on_progress:
+            self._callbacks[broadcast_id] = on_progress
+        self.scheduler.schedule(('send', broadcast_id), scheduled_for)
+
+    def schedule_delete(self, broadcast_id: str, delete_at: datetime):
+        self.scheduler.schedule(('delete', broadcast_id), delete_at)
+
+    async def _handle_due(self, due: List[Tuple[Tuple[str, str], None]]):
+        # Sends and deletions can take minutes; don't hold up the next deadline
+        for (kind, broadcast_id), _ in due:
+            if kind == 'send':
+                _spawn(self._send(broadcast_id), f"Scheduled broadcast {broadcast_id}")
+        deletions = [broadcast_id for (kind, broadcast_id), _ in due if kind == 'delete']
+        if deletions:
+            _spawn(self._delete(deletions), f"Deleting broadcasts {', '.join(deletions)}")
+
+    async def _send(self, broadcast_id: str):
+        on_progress = self._callbacks.pop(broadcast_id, None)
+        # Lease first: a claimed broadcast whose sender dies is still 'running'
+        # with an expiring lease, so resume_broadcasts picks it up
+        lease = Lease(f"broadcast:{broadcast_id}")
+        if not await lease.try_acquire():
+            return
+        broadcast = await claim_scheduled_broadcast(broadcast_id)
+        if not broadcast:
+            await lease.stop()
+            return
+        content = broadcast.get('content') or {}
+        if 'from_chat_id' not in content:
+            logger.warning(f"Scheduled broadcast {broadcast_id} has no message to copy")
+            await update_broadcast_progress(broadcast_id, {}, status='failed', lease_token=lease.token)
+            await lease.stop()
+            return
+        delete_after = broadcast.get('delete_after')
+        engine = BroadcastEngine(self.client, broadcast_id, content['from_chat_id'], content['message_id'],
+                                 on_progress=on_progress, record_messages=bool(delete_after))
+        await engine.run(lease=lease)
+        if engine.completed and delete_after:
+            self.schedule_delete(broadcast_id, datetime.utcnow() + timedelta(seconds=delete_after))
+
+    async def _delete(self, broadcast_ids: List[str]):
+        set_api_lane('background')
+        for broadcast_id in broadcast_ids:
+            claimed = await claim_broadcast_deletion(broadcast_id, INSTANCE_ID)
+            if claimed:
+                await self._delete_broadcast(broadcast_id, claimed.get('sent_at'))
+
+    async def _delete_broadcast(self, broadcast_id: str, sent_at: Optional[datetime]):
+        # Past the window every private-chat copy is too old; don't ask Telegram
+        expired = sent_at is not None and datetime.utcnow() - sent_at > PRIVATE_DELETE_WINDOW
+        requested = deleted = too_old = 0
+        by_chat: Dict[int, List[int]] = {}
+        async for messages in iter_broadcast_messages(broadcast_id):
+            for chat_id, message_id in messages:
+                if expired and chat_id > 0:
+                    too_old += 1
+                    continue
+                by_chat.setdefault(chat_id, []).append(message_id)
+                requested += 1
+            if len(by_chat) >= BROADCAST_DELETE_BATCH:
+                deleted += await self._delete_chats(by_chat)
+                by_chat = {}
+        deleted += await self._delete_chats(by_chat)
+        undeletable = too_old + requested - deleted
+        await mark_broadcast_deleted(broadcast_id, deleted, undeletable)
+        if undeletable:
+            logger.warning(f"{undeletable} messages of broadcast {broadcast_id} could not be deleted")
+        logger.info(f"Deleted {deleted} messages of broadcast {broadcast_id}")
+
+    async def _delete_chats(self, by_chat: Dict[int, List[int]]) -> int:
+        counts = await asyncio.gather(*(self._delete_chat(chat_id, message_ids)
+                                        for chat_id, message_ids in by_chat.items()))
+        return sum(counts)
+
+    async def _delete_chat(self, chat_id: int, message_ids: List[int]) -> int:
+        async with self._semaphore:
+            deleted = await delete_chat_messages(self.client, chat_id, message_ids)
+        self.deleted += deleted
+        return deleted
+
+# ========== BROADCAST CONTROL ==========
+async def start_broadcast(client, from_chat_id: int, message_id: int,
+                          on_progress: ProgressCallback = None, scheduled_for: datetime = None,
+                          delete_after: int = None) -> str:
+    """Create a broadcast and send it now or at scheduled_for (naive UTC).
+
+    With delete_after (seconds) the sent copies are deleted that long after
+    the broadcast finishes.
+    """
+    # Random suffix so two broadcasts started in the same second don't collide
+    broadcast_id = f"broadcast_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+    scheduled_for = scheduled_for or datetime.utcnow()
+    await save_broadcast(broadcast_id, 'copy', {'from_chat_id': from_chat_id, 'message_id': message_id},
+                         scheduled_for, delete_after)
+    client.broadcast_dispatcher.schedule_send(broadcast_id, scheduled_for, on_progress)
+    return broadcast_id
+
+async def resume_broadcasts(client) -> int:
+    """Resume broadcasts whose sender stopped (restart or dead instance)"""
+    running = await get_running_broadcasts()
+    for broadcast in running:
+        content = broadcast.get('content') or {}
+        if 'from_chat_id' not in content:
+            continue
+        engine = BroadcastEngine(client, broadcast['_id'], content['from_chat_id'], content['message_id'],
+                                 record_messages=bool(broadcast.get('delete_after')))
+        # run() returns at once if another instance still holds the broadcast
+        _spawn(engine.run(resume=broadcast.get('progress')), f"Resumed broadcast {broadcast['_id']}")
+    return len(running)
+
+async def get_broadcast_progress(broadcast_id: str) -> Optional[Dict]:
+    """Get last checkpointed progress of a broadcast"""
+    broadcast = await get_broadcast(broadcast_id)
+    return broadcast.get('progress') if broadcast else None
+
+def format_broadcast_progress(progress: Dict) -> str:
+    """Format broadcast progress for display"""
+    return (f"<b>📢 Broadcast Progress</b>\n\n"
+            f"<b>✅ Sent:</b> {progress.get('sent', 0)}\n"
+            f"<b>🚫 Blocked:</b> {progress.get('blocked', 0)}\n"
+            f"<b>❌ Failed:</b> {progress.get('failed', 0)}\n"
+            f"<b>⚡ Speed:</b> {progress.get('rate', 0)} msgs/sec\n"
+            f"<b>⏱ Elapsed:</b> {progress.get('elapsed', 0)}s")
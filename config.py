@@ -1,8 +1,16 @@
 import os
+import socket
+import atexit
+import json
+import queue
 from os import environ
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
+from typing import Dict, List
+
+# Bad settings found at import, reported once setup_logging() has run
+_config_warnings: List[str] = []
 
 # ========== BOT CONFIGURATION ==========
 TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN", "")
@@ -14,11 +22,111 @@ PORT = int(os.environ.get("PORT", "8080"))
 # ========== DATABASE CONFIG ==========
 DB_URI = os.environ.get("DATABASE_URL", "")
 DB_NAME = os.environ.get("DATABASE_NAME", "crunchyroll_bot")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "5"))  # connections opened at start and kept warm
+MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")  # e.g. "zstd,snappy,zlib"; zstd/snappy need extra packages
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "30000"))  # 0 waits forever
+# Serve read-only queries (search index, listings, stats, backups) from secondaries
+MONGO_SECONDARY_READS = os.environ.get("MONGO_SECONDARY_READS", "False").lower() in ("1", "true", "yes")
+MONGO_SLOW_OP_MS = int(os.environ.get("MONGO_SLOW_OP_MS", "200"))  # log commands slower than this
 
 # ========== BOT SETTINGS ==========
 TG_BOT_WORKERS = int(os.environ.get("TG_BOT_WORKERS", "50"))
+# Identifies this process when several instances share DB_NAME
+INSTANCE_ID = os.environ.get("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
 BOT_CREATION_DATE = datetime(2026, 1, 26)  # Fixed creation date
 
+# ========== TELEGRAM API LIMITS ==========
+API_GLOBAL_RATE = float(os.environ.get("API_GLOBAL_RATE", "25"))  # calls/sec across all chats
+API_GLOBAL_BURST = float(os.environ.get("API_GLOBAL_BURST", "30"))
+API_USER_RATE = float(os.environ.get("API_USER_RATE", "1"))  # messages/sec into one private chat
+API_GROUP_RATE = float(os.environ.get("API_GROUP_RATE", "0.33"))  # messages/sec into one group or channel
+API_CHAT_BURST = float(os.environ.get("API_CHAT_BURST", "3"))
+API_RATE_RECOVERY = int(os.environ.get("API_RATE_RECOVERY", "30"))  # quiet seconds before the rate climbs back
+API_FLOOD_SLEEP_THRESHOLD = int(os.environ.get("API_FLOOD_SLEEP_THRESHOLD", "60"))  # longer FloodWaits are raised
+
+# ========== USER WRITES ==========
+USER_FLUSH_SIZE = int(os.environ.get("USER_FLUSH_SIZE", "500"))  # pending users that trigger a flush
+USER_FLUSH_INTERVAL = int(os.environ.get("USER_FLUSH_INTERVAL", "5"))  # seconds
+
+# ========== STATISTICS ==========
+STATS_REFRESH_INTERVAL = int(os.environ.get("STATS_REFRESH_INTERVAL", "300"))  # seconds
+
+# ========== SYSTEM MONITOR ==========
+SYSTEM_SAMPLE_INTERVAL = int(os.environ.get("SYSTEM_SAMPLE_INTERVAL", "5"))  # seconds between samples
+SYSTEM_SAMPLE_HISTORY = int(os.environ.get("SYSTEM_SAMPLE_HISTORY", "3600"))  # seconds of samples kept
+
+# ========== LOOP WATCHDOG ==========
+WATCHDOG_INTERVAL = float(os.environ.get("WATCHDOG_INTERVAL", "0.1"))  # seconds between loop heartbeats
+WATCHDOG_STALL_THRESHOLD = float(os.environ.get("WATCHDOG_STALL_THRESHOLD", "0.5"))  # blocked this long = stall
+WATCHDOG_HISTORY = int(os.environ.get("WATCHDOG_HISTORY", "50"))  # stalls kept for /perf
+
+# Seconds of event-loop lag after which /healthz reports unhealthy
+HEALTH_MAX_LOOP_LAG = float(os.environ.get("HEALTH_MAX_LOOP_LAG", "1"))
+
+# ========== BROADCAST SETTINGS ==========
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "20"))
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "1000"))
+BROADCAST_CHECKPOINT_INTERVAL = int(os.environ.get("BROADCAST_CHECKPOINT_INTERVAL", "10"))  # seconds
+BROADCAST_DELETE_BATCH = int(os.environ.get("BROADCAST_DELETE_BATCH", "5000"))  # chats per deletion round
+
+# ========== LINK REVOCATION ==========
+LINK_REVOKE_CONCURRENCY = int(os.environ.get("LINK_REVOKE_CONCURRENCY", "10"))
+# Seconds between sweeps for expired links no local scheduler knows, e.g. of a dead instance
+LINK_SWEEP_INTERVAL = int(os.environ.get("LINK_SWEEP_INTERVAL", "60"))
+
+# ========== MESSAGE AUTO-DELETE ==========
+DELETE_QUEUE_POLL_INTERVAL = int(os.environ.get("DELETE_QUEUE_POLL_INTERVAL", "5"))  # seconds
+DELETE_QUEUE_BATCH = int(os.environ.get("DELETE_QUEUE_BATCH", "1000"))  # queued entries per drain round
+DELETE_QUEUE_CONCURRENCY = int(os.environ.get("DELETE_QUEUE_CONCURRENCY", "10"))  # chats deleted in parallel
+
+# ========== LEADER ELECTION ==========
+LEASE_TTL = int(os.environ.get("LEASE_TTL", "15"))  # seconds before a dead owner's lease can be taken
+LEASE_RENEW_INTERVAL = int(os.environ.get("LEASE_RENEW_INTERVAL", "5"))
+
+# ========== INVITE LINK POOL ==========
+LINK_POOL_SIZE = int(os.environ.get("LINK_POOL_SIZE", "10"))  # links kept per channel and type
+LINK_POOL_LOW_WATER = int(os.environ.get("LINK_POOL_LOW_WATER", "3"))
+LINK_POOL_LINK_TTL = int(os.environ.get("LINK_POOL_LINK_TTL", "21600"))  # pooled links expire after 6 hours
+LINK_POOL_SWEEP_INTERVAL = int(os.environ.get("LINK_POOL_SWEEP_INTERVAL", "300"))
+
+# ========== CHANNEL METADATA CACHE ==========
+CHANNEL_INFO_TTL = int(os.environ.get("CHANNEL_INFO_TTL", "3600"))  # refresh title/type/bot rights hourly
+CHANNEL_INFO_NEGATIVE_TTL = int(os.environ.get("CHANNEL_INFO_NEGATIVE_TTL", "60"))  # retry failed lookups
+
+# ========== FORCE SUB CHECK ==========
+FSUB_CHECK_CONCURRENCY = int(os.environ.get("FSUB_CHECK_CONCURRENCY", "10"))
+FSUB_POSITIVE_TTL = int(os.environ.get("FSUB_POSITIVE_TTL", "600"))  # cache joined users for 10 minutes
+FSUB_NEGATIVE_TTL = int(os.environ.get("FSUB_NEGATIVE_TTL", "15"))  # re-check non-members quickly
+FSUB_MAX_FLOOD_WAIT = int(os.environ.get("FSUB_MAX_FLOOD_WAIT", "5"))  # seconds we'll wait before giving up
+
+# ========== DEEP LINK TOKENS ==========
+# HMAC key for /start tokens; defaults to one derived from TG_BOT_TOKEN.
+# Changing it invalidates every link already shared.
+LINK_TOKEN_SECRET = os.environ.get("LINK_TOKEN_SECRET", "")
+LINK_TOKEN_CACHE_SIZE = int(os.environ.get("LINK_TOKEN_CACHE_SIZE", "4096"))
+if not LINK_TOKEN_SECRET and not TG_BOT_TOKEN:
+    _config_warnings.append("Neither LINK_TOKEN_SECRET nor TG_BOT_TOKEN is set, so /start tokens are signed "
+                            "with a publicly known key and can be forged")
+
+# ========== DATA RETENTION ==========
+LINK_ARCHIVE_AFTER_DAYS = int(os.environ.get("LINK_ARCHIVE_AFTER_DAYS", "7"))  # roll revoked links into daily summaries
+LINK_RETENTION_DAYS = int(os.environ.get("LINK_RETENTION_DAYS", "30"))  # TTL backstop for links the job missed
+CHANNEL_RETENTION_DAYS = int(os.environ.get("CHANNEL_RETENTION_DAYS", "30"))  # keep deleted channels this long
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "3600"))  # seconds between archival runs
+RETENTION_BATCH = int(os.environ.get("RETENTION_BATCH", "5000"))
+# The TTL index must not drop revoked links before the archival job has counted them
+if LINK_RETENTION_DAYS <= LINK_ARCHIVE_AFTER_DAYS:
+    _config_warnings.append(f"LINK_RETENTION_DAYS ({LINK_RETENTION_DAYS}) must exceed LINK_ARCHIVE_AFTER_DAYS "
+                            f"({LINK_ARCHIVE_AFTER_DAYS}), using {LINK_ARCHIVE_AFTER_DAYS + 1}")
+    LINK_RETENTION_DAYS = LINK_ARCHIVE_AFTER_DAYS + 1
+
+# ========== BACKUP SETTINGS ==========
+BACKUP_SEGMENT_BYTES = int(os.environ.get("BACKUP_SEGMENT_BYTES", str(8 * 1024 * 1024)))  # raw NDJSON per segment
+BACKUP_RESTORE_BATCH = int(os.environ.get("BACKUP_RESTORE_BATCH", "1000"))
+
 # ========== MEDIA FILES ==========
 START_PIC = os.environ.get("START_PIC", "https://telegra.ph/file/f3d3aff9ec422158feb05-d2180e3665e0ac4d32.jpg")
 DEFAULT_IMAGE = os.environ.get("DEFAULT_IMAGE", "https://telegra.ph/file/f3d3aff9ec422158feb05-d2180e3665e0ac4d32.jpg")
@@ -95,13 +203,117 @@ if OWNER_ID not in ADMINS:
 # Add default admin
 ADMINS.append(6040503076)
 
+# Seconds before the in-memory admin set is reloaded from database
+ADMIN_CACHE_TTL = int(os.environ.get("ADMIN_CACHE_TTL", "300"))
+# Seconds before cached settings are reconciled with the database
+SETTINGS_CACHE_TTL = int(os.environ.get("SETTINGS_CACHE_TTL", "60"))
+# Seconds before the channel search index is rebuilt, picking up other instances' changes
+CHANNEL_INDEX_TTL = int(os.environ.get("CHANNEL_INDEX_TTL", "300"))
+
 # ========== LOGGING ==========
+# Records are queued by a QueueHandler and written by a QueueListener thread,
+# so file writes and rotation never run on the event loop.
 LOG_FILE_NAME = "crunchyroll_bot.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s - %(levelname)s] - %(name)s - %(message)s",
-    datefmt='%d-%b-%y %H:%M:%S',
-    handlers=[
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_JSON = os.environ.get("LOG_JSON", "False").lower() in ("1", "true", "yes")
+# Keep only a fraction of INFO/DEBUG records from noisy loggers, e.g. "database=0.1,scheduler=0.5"
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'instance': INSTANCE_ID
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class LoopQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() runs the full Formatter (timestamps, tracebacks) on
+    the calling thread. Here only the message itself is rendered, so later
+    changes to the arguments can't alter it; everything else happens in the
+    writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Pass a fixed fraction of INFO/DEBUG records per logger; warnings always pass"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+        self._resolved: Dict[str, float] = {}
+        self._credit: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            # Longest configured prefix wins: "pyrogram" also covers "pyrogram.session"
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            rate = self.rates[max(matches, key=len)] if matches else 1.0
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1:
+            return True
+        credit = self._credit.get(record.name, 0.0) + rate
+        if credit >= 1:
+            self._credit[record.name] = credit - 1
+            return True
+        self._credit[record.name] = credit
+        self.dropped += 1
+        return False
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            value = float(rate)
+        except ValueError:
+            value = None
+        if not name.strip() or value is None or not 0 <= value <= 1:
+            _config_warnings.append(f"Ignoring LOG_SAMPLE entry {item!r}, expected name=rate with rate in 0..1")
+            continue
+        rates[name.strip()] = value
+    return rates
+
+def _log_level(name: str) -> int:
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        _config_warnings.append(f"Unknown LOG_LEVEL {name!r}, using INFO")
+        return logging.INFO
+    return level
+
+def setup_logging() -> QueueListener:
+    """Route the root logger through a queue to a background writer thread.
+
+    Called by the entry point, so importing config has no side effects
+    beyond creating loggers.
+    """
+    if LOG_JSON:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s - %(levelname)s] - %(name)s - %(message)s",
+                                      datefmt='%d-%b-%y %H:%M:%S')
+    handlers = [
         RotatingFileHandler(
             LOG_FILE_NAME,
             maxBytes=10000000,
@@ -109,7 +321,25 @@ logging.basicConfig(
         ),
         logging.StreamHandler()
     ]
-)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LoopQueueHandler(log_queue)
+    queue_handler.addFilter(log_sampler)
+    root = logging.getLogger()
+    root.setLevel(_log_level(LOG_LEVEL))
+    root.handlers = [queue_handler]
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    for warning in _config_warnings:
+        logging.getLogger(__name__).warning(warning)
+    return listener
+
+log_sampler = SamplingFilter(_parse_sample_rates(LOG_SAMPLE))
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 def LOGGER(name: str) -> logging.Logger:
@@ -1,71 +1,419 @@
 import motor.motor_asyncio
+from pymongo import UpdateOne, ReturnDocument, ReadPreference, monitoring
+from pymongo.server_type import SERVER_TYPE
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import Binary
 import base64
+import itertools
 import json
+import struct
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
-from config import DB_URI, DB_NAME, BOT_CREATION_DATE
+from typing import List, Dict, Optional, Any, AsyncIterator, Callable, Tuple
+from config import (LOGGER, DB_URI, DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_COMPRESSORS,
+                    MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+                    MONGO_SECONDARY_READS, MONGO_SLOW_OP_MS, LINK_ARCHIVE_AFTER_DAYS, LINK_RETENTION_DAYS,
+                    CHANNEL_RETENTION_DAYS, RETENTION_BATCH, BOT_CREATION_DATE, ADMINS, ADMIN_CACHE_TTL, SETTINGS_CACHE_TTL,
+                    CHANNEL_INDEX_TTL,
+                    USER_FLUSH_SIZE, USER_FLUSH_INTERVAL, STATS_REFRESH_INTERVAL,
+                    DEFAULT_REVOKE_TIME, DEFAULT_DELETE_TIME, DEFAULT_BUTTON_TEXT, DEFAULT_FSUB_MESSAGE)
 import asyncio
+import re
+import time
+from search_index import ChannelSearchIndex
+from metrics import timed_db
 
-# MongoDB Client
-client = motor.motor_asyncio.AsyncIOMotorClient(DB_URI)
-db = client[DB_NAME]
+# ========== CONNECTION ==========
+# The client is created on first use, so importing this module (and every
+# module that imports it) never opens a connection.
+logger = LOGGER(__name__)
+
+_client = None
+_db = None
+
+# Error codes callers expect and handle: DuplicateKey, IndexOptionsConflict
+_EXPECTED_FAILURES = {11000, 85}
+
+class _CommandLogger(monitoring.CommandListener):
+    """Log commands slower than MONGO_SLOW_OP_MS and failed commands"""
+
+    def __init__(self):
+        self._collections: Dict[int, Any] = {}
+
+    def started(self, event):
+        self._collections[event.request_id] = event.command.get(event.command_name)
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, None)
+        if event.duration_micros >= MONGO_SLOW_OP_MS * 1000:
+            logger.warning(f"Slow Mongo {event.command_name} on {collection}: "
+                           f"{event.duration_micros / 1000:.0f} ms")
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, None)
+        code = event.failure.get('code') if isinstance(event.failure, dict) else None
+        # Handled by the caller, e.g. acquire_lease losing the upsert race every heartbeat
+        log = logger.debug if code in _EXPECTED_FAILURES else logger.warning
+        log(f"Mongo {event.command_name} on {collection} failed after "
+            f"{event.duration_micros / 1000:.0f} ms: {event.failure}")
+
+class _TopologyLogger(monitoring.ServerListener):
+    """Log servers dropping out of and coming back into the topology"""
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        before, after = event.previous_description.server_type, event.new_description.server_type
+        if before == after:
+            return
+        if after == SERVER_TYPE.Unknown:
+            logger.warning(f"Lost connection to Mongo server {event.server_address}: "
+                           f"{event.new_description.error}")
+        elif before == SERVER_TYPE.Unknown:
+            logger.info(f"Connected to Mongo server {event.server_address} "
+                        f"as {event.new_description.server_type_name}")
+        else:
+            logger.info(f"Mongo server {event.server_address} is now {event.new_description.server_type_name}")
+
+    def closed(self, event):
+        pass
+
+def get_db():
+    """The bot's database, connecting on first use"""
+    global _client, _db
+    if _db is None:
+        options = {
+            'maxPoolSize': MONGO_MAX_POOL_SIZE,
+            'minPoolSize': MONGO_MIN_POOL_SIZE,
+            'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            'socketTimeoutMS': MONGO_SOCKET_TIMEOUT_MS or None,
+            'event_listeners': [_CommandLogger(), _TopologyLogger()],
+        }
+        if MONGO_COMPRESSORS:
+            options['compressors'] = MONGO_COMPRESSORS
+        _client = motor.motor_asyncio.AsyncIOMotorClient(DB_URI, **options)
+        _db = _client[DB_NAME]
+    return _db
+
+def use_database(database) -> None:
+    """Point the data layer at another database (benchmarks, scripts)"""
+    global _db
+    _db = database
+
+class _Collection:
+    """Collection handle that resolves against the current database on use.
+
+    `reads` is the same collection with secondary-preferred reads when
+    MONGO_SECONDARY_READS is on; use it only for queries that tolerate
+    slightly stale data.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._db = None
+        self._collection = None
+        self._reads = None
+
+    def _resolve(self):
+        database = get_db()
+        if database is not self._db:
+            self._db = database
+            self._collection = database[self.name]
+            self._reads = self._collection
+            if MONGO_SECONDARY_READS:
+                self._reads = self._collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        return self._collection
+
+    @property
+    def reads(self):
+        self._resolve()
+        return self._reads
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
 
 # Collections
-users_collection = db['users']
-channels_collection = db['channels']
-admins_collection = db['admins']
-broadcasts_collection = db['broadcasts']
-settings_collection = db['settings']
-fsub_collection = db['force_sub']
-links_collection = db['temporary_links']
-backup_collection = db['backups']
+users_collection = _Collection('users')
+channels_collection = _Collection('channels')
+admins_collection = _Collection('admins')
+broadcasts_collection = _Collection('broadcasts')
+broadcast_messages_collection = _Collection('broadcast_messages')
+settings_collection = _Collection('settings')
+fsub_collection = _Collection('force_sub')
+links_collection = _Collection('temporary_links')
+deletions_collection = _Collection('message_deletions')
+backup_collection = _Collection('backups')
+backup_chunks_collection = _Collection('backup_chunks')
+daily_stats_collection = _Collection('daily_stats')
+link_archive_collection = _Collection('link_archive')
+leases_collection = _Collection('leases')
 
-# ========== USER MANAGEMENT ==========
-async def add_user(user_id: int, username: str = None, first_name: str = None) -> bool:
-    """Add user to database"""
+async def ping() -> bool:
+    """Check database connectivity"""
     try:
-        await users_collection.update_one(
-            {'_id': user_id},
-            {'$set': {
-                'username': username,
-                'first_name': first_name,
-                'last_activity': datetime.utcnow(),
-                'joined_at': datetime.utcnow()
-            }},
-            upsert=True
-        )
+        await get_db().command('ping')
         return True
-    except Exception as e:
-        print(f"Error adding user {user_id}: {e}")
+    except:
         return False
 
+@timed_db
+async def warm_up() -> float:
+    """Ping, then open MONGO_MIN_POOL_SIZE connections; returns the ping time in ms"""
+    database = get_db()
+    started = time.perf_counter()
+    await database.command('ping')
+    latency = (time.perf_counter() - started) * 1000
+    # Concurrent commands each need their own connection
+    await asyncio.gather(*(database.command('ping') for _ in range(MONGO_MIN_POOL_SIZE - 1)))
+    return latency
+
+# ========== INDEXES ==========
+# (collection, keys, options, queries served)
+INDEXES = [
+    (links_collection, [('status', 1), ('expires_at', 1)], {},
+     ['get_expired_links', 'get_active_links', 'get_stats.active_links', 'get_orphaned_pooled_links',
+      'renew_pooled_links']),
+    (broadcasts_collection, [('status', 1), ('scheduled_for', 1)], {},
+     ['get_pending_broadcasts', 'get_running_broadcasts', 'get_scheduled_broadcasts',
+      'get_broadcasts_to_delete']),
+    (broadcast_messages_collection, [('broadcast_id', 1)], {},
+     ['iter_broadcast_messages', 'mark_broadcast_deleted']),
+    (settings_collection, [('key', 1)], {'unique': True},
+     ['get_setting', 'save_setting', 'is_fsub_enabled']),
+    (channels_collection, [('status', 1), ('anime_name', 1), ('_id', 1)], {},
+     ['get_all_channels', 'count_channels', 'get_channel_by_name', 'get_channels_page']),
+    (fsub_collection, [('status', 1)], {},
+     ['get_fsub_channels']),
+    # TTL backstops; archive_revoked_links() normally removes links well before this
+    (links_collection, [('revoked_at', 1)],
+     {'expireAfterSeconds': LINK_RETENTION_DAYS * 86400, 'partialFilterExpression': {'status': 'revoked'}},
+     ['archive_revoked_links']),
+    (channels_collection, [('deleted_at', 1)],
+     {'expireAfterSeconds': CHANNEL_RETENTION_DAYS * 86400, 'partialFilterExpression': {'status': 'deleted'}},
+     []),
+    (deletions_collection, [('delete_at', 1)], {},
+     ['get_due_deletions', 'get_next_deletion_time', 'count_queued_deletions']),
+    (backup_chunks_collection, [('backup_id', 1), ('collection', 1), ('seq', 1)], {},
+     ['backup.restore_backup', 'backup.delete_backup']),
+]
+
+@timed_db
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """Create indexes used by the query functions (no-op if they already exist)"""
+    created = {}
+    for collection, keys, options, queries in INDEXES:
+        try:
+            name = await collection.create_index(keys, **options)
+            created[f"{collection.name}.{name}"] = queries
+        except OperationFailure as e:
+            if e.code != 85 or 'expireAfterSeconds' not in options:  # 85: IndexOptionsConflict
+                logger.error(f"Error creating index {keys} on {collection.name}: {e}")
+                continue
+            # Retention window changed in config; update the TTL in place
+            await get_db().command('collMod', collection.name, index={
+                'keyPattern': dict(keys), 'expireAfterSeconds': options['expireAfterSeconds']})
+            created[f"{collection.name}.{dict(keys)}"] = queries
+        except Exception as e:
+            logger.error(f"Error creating index {keys} on {collection.name}: {e}")
+    return created
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+@timed_db
+async def explain_queries() -> Dict[str, Dict]:
+    """Explain the filter of each query function and flag collection scans"""
+    now = datetime.utcnow()
+    queries = {
+        'get_expired_links': (links_collection, {'expires_at': {'$lt': now}, 'status': 'active'}),
+        'get_active_links': (links_collection, {'status': 'active'}),
+        'get_pending_broadcasts': (broadcasts_collection, {'status': 'pending', 'scheduled_for': {'$lte': now}}),
+        'get_running_broadcasts': (broadcasts_collection, {'status': 'running'}),
+        'get_scheduled_broadcasts': (broadcasts_collection, {'status': 'pending'}),
+        'get_broadcasts_to_delete': (broadcasts_collection, {'status': 'sent', 'delete_after': {'$gt': 0}}),
+        'get_setting': (settings_collection, {'key': 'force_sub_enabled'}),
+        'get_all_channels': (channels_collection, {'status': 'active'}),
+        'get_fsub_channels': (fsub_collection, {'status': 'active'}),
+        'get_due_deletions': (deletions_collection, {'delete_at': {'$lte': now}}),
+    }
+    report = {}
+    for name, (collection, query) in queries.items():
+        try:
+            explain = await collection.find(query).explain()
+            stages = _plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+            report[name] = {'stages': stages, 'collscan': 'COLLSCAN' in stages}
+        except Exception as e:
+            report[name] = {'error': str(e)}
+    return report
+
+# ========== USER MANAGEMENT ==========
+# Users seen via add_user are merged in memory and written in one unordered
+# bulk_write once USER_FLUSH_SIZE are pending or every USER_FLUSH_INTERVAL.
+_pending_users: Dict[int, Dict] = {}
+_user_flush_lock = asyncio.Lock()
+user_writer_stats = {'flushes': 0, 'written': 0, 'merged': 0, 'last_batch': 0,
+                     'max_batch': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0}
+
+@timed_db
+async def add_user(user_id: int, username: str = None, first_name: str = None) -> bool:
+    """Add user to database (buffered)"""
+    if user_id in _pending_users:
+        user_writer_stats['merged'] += 1
+    _pending_users[user_id] = {
+        'username': username,
+        'first_name': first_name,
+        'last_activity': datetime.utcnow()
+    }
+    if len(_pending_users) >= USER_FLUSH_SIZE:
+        await flush_users()
+    return True
+
+@timed_db
+async def flush_users() -> int:
+    """Write buffered user updates in a single bulk_write"""
+    global _pending_users
+    async with _user_flush_lock:
+        if not _pending_users:
+            return 0
+        batch, _pending_users = _pending_users, {}
+        operations = [
+            UpdateOne(
+                {'_id': user_id},
+                {'$set': data, '$setOnInsert': {'joined_at': data['last_activity']}},
+                upsert=True
+            )
+            for user_id, data in batch.items()
+        ]
+        started = time.perf_counter()
+        try:
+            result = await users_collection.bulk_write(operations, ordered=False)
+            _record_stat('total_users', 'new_users', result.upserted_count)
+        except BulkWriteError as e:
+            logger.error(f"Error writing {len(e.details.get('writeErrors', []))} of {len(operations)} users")
+        except Exception as e:
+            logger.error(f"Error flushing {len(operations)} users: {e}")
+            # Keep them for the next flush without clobbering newer updates
+            for user_id, data in batch.items():
+                _pending_users.setdefault(user_id, data)
+            return 0
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        user_writer_stats['flushes'] += 1
+        user_writer_stats['written'] += len(operations)
+        user_writer_stats['last_batch'] = len(operations)
+        user_writer_stats['max_batch'] = max(user_writer_stats['max_batch'], len(operations))
+        user_writer_stats['last_flush_ms'] = round(elapsed_ms, 2)
+        user_writer_stats['max_flush_ms'] = max(user_writer_stats['max_flush_ms'], round(elapsed_ms, 2))
+        return len(operations)
+
+async def run_user_writer():
+    """Flush buffered users every USER_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(USER_FLUSH_INTERVAL)
+        await flush_users()
+
+def get_user_writer_stats() -> Dict:
+    """Get buffered user writer batch sizes and flush latency"""
+    stats = dict(user_writer_stats)
+    stats['pending'] = len(_pending_users)
+    stats['avg_batch'] = round(stats['written'] / stats['flushes'], 1) if stats['flushes'] else 0
+    return stats
+
+@timed_db
 async def get_user(user_id: int) -> Optional[Dict]:
     """Get user data"""
     try:
-        return await users_collection.find_one({'_id': user_id})
+        user = await users_collection.find_one({'_id': user_id})
     except:
-        return None
+        user = None
+    pending = _pending_users.get(user_id)
+    if pending:
+        user = {'_id': user_id, 'joined_at': pending['last_activity'], **(user or {}), **pending}
+    return user
 
+@timed_db
 async def get_all_users() -> List[int]:
     """Get all user IDs"""
     try:
-        users = await users_collection.find({}).to_list(None)
+        users = await users_collection.reads.find({}, {'_id': 1}).to_list(None)
         return [user['_id'] for user in users]
     except:
         return []
 
+async def iter_user_ids(after_id: int = None, batch_size: int = 1000) -> AsyncIterator[int]:
+    """Stream user IDs in ascending order, optionally starting after a given ID"""
+    query = {'_id': {'$gt': after_id}} if after_id is not None else {}
+    cursor = users_collection.reads.find(query, {'_id': 1}).sort('_id', 1).batch_size(batch_size)
+    async for user in cursor:
+        yield user['_id']
+
+@timed_db
 async def count_users() -> int:
     """Count total users"""
     try:
-        return await users_collection.count_documents({})
+        return await users_collection.reads.count_documents({})
     except:
         return 0
 
 # ========== ADMIN MANAGEMENT ==========
+# In-process admin set so filter checks don't cost a Mongo round trip per update.
+# Loaded at startup, refreshed every ADMIN_CACHE_TTL seconds and written through
+# by add_admin/remove_admin.
+_admin_ids: set = set(ADMINS)
+_admin_cache_loaded_at: Optional[float] = None  # None until the first load
+_admin_cache_lock = asyncio.Lock()
+admin_cache_stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+# Writes made while a load is reading (user_id -> is admin), reapplied to its result
+_admin_cache_loads = 0
+_admin_pending: Dict[int, bool] = {}
+
+def _set_admin(user_id: int, present: bool):
+    if present:
+        _admin_ids.add(user_id)
+    elif user_id not in ADMINS:
+        _admin_ids.discard(user_id)
+    if _admin_cache_loads:
+        _admin_pending[user_id] = present
+
+@timed_db
+async def load_admin_cache() -> int:
+    """Reload admin IDs from database, merged with config admins"""
+    global _admin_ids, _admin_cache_loaded_at, _admin_cache_loads
+    _admin_cache_loads += 1
+    try:
+        docs = await admins_collection.find({}, {'_id': 1}).to_list(None)
+    except Exception as e:
+        logger.error(f"Error loading admin cache: {e}")
+        # Keep serving the previous set, retry after the next TTL
+        _admin_cache_loaded_at = time.monotonic()
+        return len(_admin_ids)
+    finally:
+        _admin_cache_loads -= 1
+    _admin_ids = set(ADMINS) | {doc['_id'] for doc in docs}
+    for user_id, present in _admin_pending.items():
+        _set_admin(user_id, present)
+    if not _admin_cache_loads:
+        _admin_pending.clear()
+    _admin_cache_loaded_at = time.monotonic()
+    admin_cache_stats['reloads'] += 1
+    return len(_admin_ids)
+
+@timed_db
 async def add_admin(user_id: int, added_by: int = None) -> bool:
     """Add admin"""
     try:
-        await admins_collection.update_one(
+        result = await admins_collection.update_one(
             {'_id': user_id},
             {'$set': {
                 'added_by': added_by,
@@ -74,26 +422,49 @@ async def add_admin(user_id: int, added_by: int = None) -> bool:
             }},
             upsert=True
         )
+        if result.upserted_id is not None:
+            _record_stat('total_admins')
+        _set_admin(user_id, True)
         return True
     except:
         return False
 
+@timed_db
 async def remove_admin(user_id: int) -> bool:
     """Remove admin"""
     try:
         result = await admins_collection.delete_one({'_id': user_id})
+        _record_stat('total_admins', n=-result.deleted_count)
+        _set_admin(user_id, False)
         return result.deleted_count > 0
     except:
         return False
 
+def _admin_cache_stale() -> bool:
+    return _admin_cache_loaded_at is None or time.monotonic() - _admin_cache_loaded_at >= ADMIN_CACHE_TTL
+
+@timed_db
 async def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
-    try:
-        admin = await admins_collection.find_one({'_id': user_id})
-        return admin is not None
-    except:
-        return False
+    if not _admin_cache_stale():
+        admin_cache_stats['hits'] += 1
+        return user_id in _admin_ids
+    admin_cache_stats['misses'] += 1
+    async with _admin_cache_lock:
+        # Another caller may have refreshed while we waited
+        if _admin_cache_stale():
+            await load_admin_cache()
+    return user_id in _admin_ids
+
+def get_admin_cache_info() -> Dict:
+    """Get admin cache size, age and hit/miss counters"""
+    return {
+        'size': len(_admin_ids),
+        'age': round(time.monotonic() - _admin_cache_loaded_at, 1) if _admin_cache_loaded_at is not None else None,
+        **admin_cache_stats
+    }
 
+@timed_db
 async def get_all_admins() -> List[Dict]:
     """Get all admins with details"""
     try:
@@ -103,12 +474,69 @@ async def get_all_admins() -> List[Dict]:
         return []
 
 # ========== CHANNEL MANAGEMENT ==========
+# Name search is served from memory. The index is built at startup, kept in
+# sync by add_channel, update_channel_links and delete_channel, and rebuilt
+# every CHANNEL_INDEX_TTL seconds to pick up other instances' changes.
+channel_index = ChannelSearchIndex()
+_channel_index_loaded_at: Optional[float] = None
+_channel_index_lock = asyncio.Lock()
+# Changes made while a rebuild is reading are replayed on top of its result
+_channel_index_loads = 0
+_channel_index_pending: List[Callable[[], Any]] = []
+
+def _index_change(change: Callable[[], Any]) -> Any:
+    if _channel_index_loads:
+        _channel_index_pending.append(change)
+    return change()
+
+# Called with (channel_id, active) after add_channel/delete_channel, so state
+# kept outside this module (e.g. the invite link pool) follows the channel list
+_channel_listeners: List[Callable[[int, bool], None]] = []
+
+def add_channel_listener(listener: Callable[[int, bool], None]) -> None:
+    """Get told when a channel is added or deleted"""
+    _channel_listeners.append(listener)
+
+def _notify_channel(channel_id: int, active: bool):
+    for listener in _channel_listeners:
+        try:
+            listener(channel_id, active)
+        except Exception as e:
+            logger.error(f"Channel listener error for {channel_id}: {e}")
+
+@timed_db
+async def load_channel_index() -> int:
+    """Build the in-memory search index from active channels"""
+    global _channel_index_loaded_at, _channel_index_loads
+    _channel_index_loads += 1
+    try:
+        channels = await channels_collection.reads.find({'status': 'active'}).to_list(None)
+    except Exception as e:
+        logger.error(f"Error loading channel index: {e}")
+        # Keep serving the previous index, retry after the next TTL
+        _channel_index_loaded_at = time.monotonic()
+        return len(channel_index)
+    finally:
+        _channel_index_loads -= 1
+    channel_index.build(channels)
+    for change in _channel_index_pending:
+        change()
+    if not _channel_index_loads:
+        _channel_index_pending.clear()
+    _channel_index_loaded_at = time.monotonic()
+    return len(channel_index)
+
+def _channel_index_stale() -> bool:
+    return _channel_index_loaded_at is None or time.monotonic() - _channel_index_loaded_at >= CHANNEL_INDEX_TTL
+
+@timed_db
 async def add_channel(channel_id: int, anime_name: str, added_by: int) -> Dict:
     """Add channel with all link types"""
     try:
         channel_data = {
             '_id': channel_id,
-            'anime_name': anime_name,
+            # Never null: get_channels_page() pages on (anime_name, _id)
+            'anime_name': anime_name or '',
             'added_by': added_by,
             'added_at': datetime.utcnow(),
             'primary_link': None,
@@ -117,16 +545,23 @@ async def add_channel(channel_id: int, anime_name: str, added_by: int) -> Dict:
             'status': 'active',
             'last_updated': datetime.utcnow()
         }
-        await channels_collection.update_one(
+        previous = await channels_collection.find_one_and_update(
             {'_id': channel_id},
             {'$set': channel_data},
+            projection={'status': 1},
             upsert=True
         )
+        # New, or re-added after a soft delete
+        if previous is None or previous.get('status') != 'active':
+            _record_stat('total_channels')
+        _index_change(lambda: channel_index.add(channel_data))
+        _notify_channel(channel_id, True)
         return channel_data
     except Exception as e:
-        print(f"Error adding channel: {e}")
+        logger.error(f"Error adding channel: {e}")
         return {}
 
+@timed_db
 async def update_channel_links(channel_id: int, primary_link: str = None, 
                                request_token: str = None, normal_token: str = None) -> bool:
     """Update channel links"""
@@ -143,10 +578,12 @@ async def update_channel_links(channel_id: int, primary_link: str = None,
             {'_id': channel_id},
             {'$set': update_data}
         )
+        _index_change(lambda: channel_index.update(channel_id, update_data))
         return True
     except:
         return False
 
+@timed_db
 async def get_channel(channel_id: int) -> Optional[Dict]:
     """Get channel by ID"""
     try:
@@ -154,49 +591,75 @@ async def get_channel(channel_id: int) -> Optional[Dict]:
     except:
         return None
 
+@timed_db
 async def get_channel_by_name(anime_name: str) -> List[Dict]:
-    """Search channels by anime name"""
+    """Search channels by anime name, best matches first"""
+    if channel_index.loaded:
+        if _channel_index_stale():
+            async with _channel_index_lock:
+                # Another caller may have rebuilt while we waited
+                if _channel_index_stale():
+                    await load_channel_index()
+        return channel_index.search(anime_name)
     try:
-        channels = await channels_collection.find({
-            'anime_name': {'$regex': anime_name, '$options': 'i'},
+        channels = await channels_collection.reads.find({
+            'anime_name': {'$regex': re.escape(anime_name), '$options': 'i'},
             'status': 'active'
         }).to_list(None)
         return channels
     except:
         return []
 
+@timed_db
 async def get_all_channels() -> List[Dict]:
     """Get all channels"""
     try:
-        return await channels_collection.find({'status': 'active'}).to_list(None)
+        return await channels_collection.reads.find({'status': 'active'}).to_list(None)
     except:
         return []
 
+@timed_db
 async def delete_channel(channel_id: int) -> bool:
     """Delete channel"""
     try:
-        await channels_collection.update_one(
+        previous = await channels_collection.find_one_and_update(
             {'_id': channel_id},
-            {'$set': {'status': 'deleted', 'deleted_at': datetime.utcnow()}}
+            {'$set': {'status': 'deleted', 'deleted_at': datetime.utcnow()}},
+            projection={'status': 1}
         )
+        # Only an active channel counted towards the total
+        if previous is not None and previous.get('status') == 'active':
+            _record_stat('total_channels', n=-1)
+        _index_change(lambda: channel_index.remove(channel_id))
+        _notify_channel(channel_id, False)
         return True
     except:
         return False
 
+@timed_db
 async def count_channels() -> int:
     """Count total channels"""
     try:
-        return await channels_collection.count_documents({'status': 'active'})
+        return await channels_collection.reads.count_documents({'status': 'active'})
     except:
         return 0
 
 # ========== TEMPORARY LINKS MANAGEMENT ==========
+# Called with (link_id, channel_id, invite_link, expires_at) after every
+# save_temporary_link, so the link revoker schedules each link it saves
+_link_listeners: List[Callable[[str, int, str, datetime], None]] = []
+
+def add_link_listener(listener: Callable[[str, int, str, datetime], None]) -> None:
+    """Get told when a temporary link is saved"""
+    _link_listeners.append(listener)
+
+@timed_db
 async def save_temporary_link(link_id: str, channel_id: int, link_type: str, 
                               invite_link: str, expires_at: datetime, 
                               message_ids: List[int] = None) -> bool:
     """Save temporary link for auto-revocation"""
     try:
-        await links_collection.update_one(
+        result = await links_collection.update_one(
             {'_id': link_id},
             {'$set': {
                 'channel_id': channel_id,
@@ -209,10 +672,18 @@ async def save_temporary_link(link_id: str, channel_id: int, link_type: str,
             }},
             upsert=True
         )
-        return True
+        if result.upserted_id is not None:
+            _record_stat('active_links', 'links_issued')
     except:
         return False
+    for listener in _link_listeners:
+        try:
+            listener(link_id, channel_id, invite_link, expires_at)
+        except Exception as e:
+            logger.error(f"Link listener error for {link_id}: {e}")
+    return True
 
+@timed_db
 async def get_expired_links() -> List[Dict]:
     """Get expired links for cleanup"""
     try:
@@ -224,18 +695,164 @@ async def get_expired_links() -> List[Dict]:
     except:
         return []
 
+@timed_db
+async def get_active_links() -> List[Dict]:
+    """Get active links with just the fields needed to revoke them"""
+    try:
+        return await links_collection.find(
+            {'status': 'active'},
+            {'channel_id': 1, 'invite_link': 1, 'expires_at': 1}
+        ).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def claim_link(link_id: str, owner: str, ttl: int = 60) -> bool:
+    """Atomically claim an active link so only one instance revokes it"""
+    now = datetime.utcnow()
+    try:
+        # The owner may re-claim, e.g. when retrying after a FloodWait
+        claimed = await links_collection.find_one_and_update(
+            {'_id': link_id, 'status': 'active',
+             '$or': [{'claimed_until': None}, {'claimed_until': {'$lt': now}}, {'claimed_by': owner}]},
+            {'$set': {'claimed_by': owner, 'claimed_until': now + timedelta(seconds=ttl)}},
+            projection={'_id': 1}
+        )
+        return claimed is not None
+    except:
+        return False
+
+@timed_db
 async def mark_link_revoked(link_id: str) -> bool:
     """Mark link as revoked"""
     try:
-        await links_collection.update_one(
-            {'_id': link_id},
+        result = await links_collection.update_one(
+            {'_id': link_id, 'status': {'$ne': 'revoked'}},
             {'$set': {'status': 'revoked', 'revoked_at': datetime.utcnow()}}
         )
+        if result.modified_count:
+            _record_stat('active_links', 'links_revoked', -1, daily_n=1)
+        return True
+    except:
+        return False
+
+# ========== POOLED INVITE LINKS ==========
+# Links minted ahead of time by the invite link pool are recorded with status
+# 'pooled' until they are handed out or revoked. The owning instance renews
+# held_until on every sweep, so links of a crashed instance can be found and
+# revoked instead of staying usable until Telegram expires them.
+
+@timed_db
+async def save_pooled_link(invite_link: str, channel_id: int, link_type: str, expires_at: datetime,
+                           owner: str, held_until: datetime) -> bool:
+    """Record a freshly minted pooled link"""
+    try:
+        await links_collection.insert_one({
+            '_id': invite_link,
+            'channel_id': channel_id,
+            'link_type': link_type,
+            'invite_link': invite_link,
+            'expires_at': expires_at,
+            'created_at': datetime.utcnow(),
+            'status': 'pooled',
+            'pooled_by': owner,
+            'held_until': held_until
+        })
+        return True
+    except Exception as e:
+        logger.error(f"Error saving pooled link: {e}")
+        return False
+
+@timed_db
+async def renew_pooled_links(owner: str, held_until: datetime) -> int:
+    """Mark an instance's pooled links as still held"""
+    try:
+        result = await links_collection.update_many(
+            {'status': 'pooled', 'pooled_by': owner},
+            {'$set': {'held_until': held_until}}
+        )
+        return result.modified_count
+    except:
+        return 0
+
+@timed_db
+async def get_orphaned_pooled_links(owner: str = None) -> List[Dict]:
+    """Pooled links nobody holds any more, plus every pooled link of owner"""
+    orphaned = [{'held_until': {'$lt': datetime.utcnow()}}]
+    if owner:
+        orphaned.append({'pooled_by': owner})
+    try:
+        return await links_collection.find(
+            {'status': 'pooled', '$or': orphaned},
+            {'channel_id': 1}
+        ).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def remove_pooled_links(invite_links: List[str]) -> bool:
+    """Forget pooled links that were handed out or revoked"""
+    if not invite_links:
+        return True
+    try:
+        await links_collection.delete_many({'_id': {'$in': invite_links}, 'status': 'pooled'})
         return True
     except:
         return False
 
+# ========== MESSAGE DELETION QUEUE ==========
+@timed_db
+async def queue_message_deletion(chat_id: int, message_ids: List[int], delete_at: datetime) -> bool:
+    """Persist messages to be deleted at delete_at"""
+    try:
+        await deletions_collection.insert_one({
+            'chat_id': chat_id,
+            'message_ids': message_ids,
+            'delete_at': delete_at
+        })
+        return True
+    except Exception as e:
+        logger.error(f"Error queueing message deletion: {e}")
+        return False
+
+@timed_db
+async def get_due_deletions(limit: int = 1000) -> List[Dict]:
+    """Get the oldest queued deletions that are due"""
+    try:
+        return await deletions_collection.find(
+            {'delete_at': {'$lte': datetime.utcnow()}}
+        ).sort('delete_at', 1).limit(limit).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def get_next_deletion_time() -> Optional[datetime]:
+    """Get when the next queued deletion is due"""
+    try:
+        entry = await deletions_collection.find_one({}, {'delete_at': 1}, sort=[('delete_at', 1)])
+        return entry['delete_at'] if entry else None
+    except:
+        return None
+
+@timed_db
+async def remove_deletions(entry_ids: List[Any]) -> bool:
+    """Drop deletions that have been carried out"""
+    try:
+        await deletions_collection.delete_many({'_id': {'$in': entry_ids}})
+        return True
+    except:
+        return False
+
+@timed_db
+async def count_queued_deletions() -> int:
+    """Count queued deletions"""
+    try:
+        return await deletions_collection.estimated_document_count()
+    except:
+        return 0
+
 # ========== BROADCAST MANAGEMENT ==========
+@timed_db
 async def save_broadcast(broadcast_id: str, broadcast_type: str, content: Dict,
                          scheduled_for: datetime = None, delete_after: int = None) -> bool:
     """Save broadcast data"""
@@ -256,6 +873,7 @@ async def save_broadcast(broadcast_id: str, broadcast_type: str, content: Dict,
     except:
         return False
 
+@timed_db
 async def get_pending_broadcasts() -> List[Dict]:
     """Get pending broadcasts"""
     try:
@@ -267,7 +885,222 @@ async def get_pending_broadcasts() -> List[Dict]:
     except:
         return []
 
+@timed_db
+async def get_broadcast(broadcast_id: str) -> Optional[Dict]:
+    """Get broadcast by ID"""
+    try:
+        return await broadcasts_collection.find_one({'_id': broadcast_id})
+    except:
+        return None
+
+def _fenced(broadcast_id: str, lease_token: Optional[int]) -> Dict:
+    # Matches unless a sender holding a newer lease has already written
+    query = {'_id': broadcast_id}
+    if lease_token is not None:
+        query['lease_token'] = {'$not': {'$gt': lease_token}}
+    return query
+
+@timed_db
+async def update_broadcast_progress(broadcast_id: str, progress: Dict, status: str = None,
+                                    lease_token: int = None) -> bool:
+    """Checkpoint broadcast delivery progress.
+
+    With lease_token the write is fenced: it is skipped, and False returned,
+    once another instance has written with a newer token (see
+    broadcast_fenced_out to tell that from a failed write).
+    """
+    try:
+        update_data = {'progress': progress, 'updated_at': datetime.utcnow()}
+        if status:
+            update_data['status'] = status
+            if status == 'sent':
+                update_data['sent_at'] = datetime.utcnow()
+        if lease_token is not None:
+            update_data['lease_token'] = lease_token
+        result = await broadcasts_collection.update_one(
+            _fenced(broadcast_id, lease_token),
+            {'$set': update_data}
+        )
+        return result.matched_count > 0
+    except:
+        return False
+
+@timed_db
+async def get_running_broadcasts() -> List[Dict]:
+    """Get broadcasts interrupted while sending"""
+    try:
+        return await broadcasts_collection.find({'status': 'running'}).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def get_scheduled_broadcasts() -> List[Dict]:
+    """Get every broadcast waiting for its scheduled time"""
+    try:
+        return await broadcasts_collection.find(
+            {'status': 'pending', 'scheduled_for': {'$ne': None}},
+            {'scheduled_for': 1}
+        ).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def claim_scheduled_broadcast(broadcast_id: str) -> Optional[Dict]:
+    """Atomically move a pending broadcast to running, None if someone else did"""
+    try:
+        return await broadcasts_collection.find_one_and_update(
+            {'_id': broadcast_id, 'status': 'pending'},
+            {'$set': {'status': 'running', 'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+    except:
+        return None
+
+# Sent messages are stored as packed (chat_id int64, message_id int32) pairs,
+# one document per checkpoint, so a million recipients take about 12 MB.
+_MESSAGE_PAIR = struct.Struct(">qi")
+
+@timed_db
+async def broadcast_fenced_out(broadcast_id: str, lease_token: int) -> bool:
+    """Whether a sender holding a newer lease than lease_token has written to the broadcast"""
+    try:
+        return await broadcasts_collection.find_one(
+            {'_id': broadcast_id, 'lease_token': {'$gt': lease_token}}, {'_id': 1}
+        ) is not None
+    except:
+        return False
+
+@timed_db
+async def save_broadcast_messages(broadcast_id: str, messages: List[Tuple[int, int]]) -> bool:
+    """Record (chat_id, message_id) pairs sent by a broadcast"""
+    if not messages:
+        return True
+    try:
+        data = struct.pack(">" + "qi" * len(messages), *itertools.chain.from_iterable(messages))
+        await broadcast_messages_collection.insert_one({
+            'broadcast_id': broadcast_id,
+            'count': len(messages),
+            'data': Binary(data)
+        })
+        return True
+    except Exception as e:
+        logger.error(f"Error saving broadcast messages: {e}")
+        return False
+
+async def iter_broadcast_messages(broadcast_id: str) -> AsyncIterator[List[Tuple[int, int]]]:
+    """Yield the recorded (chat_id, message_id) pairs of a broadcast chunk by chunk"""
+    cursor = broadcast_messages_collection.find({'broadcast_id': broadcast_id}, {'data': 1})
+    async for chunk in cursor:
+        yield list(_MESSAGE_PAIR.iter_unpack(chunk['data']))
+
+@timed_db
+async def get_broadcasts_to_delete() -> List[Dict]:
+    """Get sent broadcasts whose messages are still to be deleted"""
+    try:
+        return await broadcasts_collection.find(
+            {'status': 'sent', 'delete_after': {'$gt': 0}},
+            {'sent_at': 1, 'delete_after': 1}
+        ).to_list(None)
+    except:
+        return []
+
+@timed_db
+async def claim_broadcast_deletion(broadcast_id: str, owner: str, ttl: int = 600) -> Optional[Dict]:
+    """Atomically claim a sent broadcast so only one instance deletes its messages.
+
+    Returns the broadcast's sent_at, or None if another instance holds the
+    claim. An unfinished claim expires after ttl seconds.
+    """
+    now = datetime.utcnow()
+    try:
+        return await broadcasts_collection.find_one_and_update(
+            {'_id': broadcast_id, 'status': 'sent',
+             '$or': [{'claimed_until': None}, {'claimed_until': {'$lt': now}}]},
+            {'$set': {'claimed_by': owner, 'claimed_until': now + timedelta(seconds=ttl)}},
+            projection={'sent_at': 1}
+        )
+    except:
+        return None
+
+@timed_db
+async def mark_broadcast_deleted(broadcast_id: str, deleted: int, undeletable: int = 0) -> bool:
+    """Mark a broadcast's messages as deleted and drop the recorded IDs.
+
+    undeletable counts messages Telegram would not delete (too old, already
+    gone or chat unavailable); they are not retried.
+    """
+    try:
+        await broadcasts_collection.update_one(
+            {'_id': broadcast_id},
+            {'$set': {'status': 'deleted', 'deleted_at': datetime.utcnow(), 'deleted_messages': deleted,
+                      'undeletable_messages': undeletable}}
+        )
+        await broadcast_messages_collection.delete_many({'broadcast_id': broadcast_id})
+        return True
+    except:
+        return False
+
 # ========== SETTINGS MANAGEMENT ==========
+# All settings are held in memory. save_setting writes through, and the whole
+# collection is reloaded once the copy is older than SETTINGS_CACHE_TTL so
+# edits made by another instance show up within that window.
+_settings: Dict[str, Any] = {}
+_settings_loaded_at: Optional[float] = None  # None until the first load
+_settings_lock = asyncio.Lock()
+settings_cache_stats = {'reloads': 0}
+# save_setting writes made while a load is reading, reapplied to its result
+_settings_loads = 0
+_settings_pending: Dict[str, Any] = {}
+
+@dataclass(frozen=True)
+class BotSettings:
+    """Typed view of the settings consulted on user requests"""
+    force_sub_enabled: bool
+    revoke_time: int
+    delete_time: int
+    button_text: str
+    fsub_message: str
+
+@timed_db
+async def load_settings_cache() -> int:
+    """Reload all settings from database"""
+    global _settings, _settings_loaded_at, _settings_loads
+    _settings_loads += 1
+    try:
+        settings = await settings_collection.find({}, {'key': 1, 'value': 1}).to_list(None)
+    except Exception as e:
+        logger.error(f"Error loading settings cache: {e}")
+        _settings_loaded_at = time.monotonic()
+        return len(_settings)
+    finally:
+        _settings_loads -= 1
+    _settings = {s['key']: s['value'] for s in settings}
+    _settings.update(_settings_pending)
+    if not _settings_loads:
+        _settings_pending.clear()
+    _settings_loaded_at = time.monotonic()
+    settings_cache_stats['reloads'] += 1
+    return len(_settings)
+
+def _settings_stale() -> bool:
+    return _settings_loaded_at is None or time.monotonic() - _settings_loaded_at >= SETTINGS_CACHE_TTL
+
+async def _fresh_settings() -> Dict[str, Any]:
+    if _settings_stale():
+        async with _settings_lock:
+            if _settings_stale():
+                await load_settings_cache()
+    return _settings
+
+def get_settings_cache_info() -> Dict:
+    """Get settings cache size, age and reload count"""
+    return {
+        'size': len(_settings),
+        'age': round(time.monotonic() - _settings_loaded_at, 1) if _settings_loaded_at is not None else None,
+        **settings_cache_stats
+    }
+
+@timed_db
 async def save_setting(key: str, value: Any) -> bool:
     """Save bot setting"""
     try:
@@ -276,27 +1109,44 @@ async def save_setting(key: str, value: Any) -> bool:
             {'$set': {'value': value, 'updated_at': datetime.utcnow()}},
             upsert=True
         )
+        _settings[key] = value
+        if _settings_loads:
+            _settings_pending[key] = value
         return True
     except:
         return False
 
+@timed_db
 async def get_setting(key: str, default: Any = None) -> Any:
     """Get bot setting"""
-    try:
-        setting = await settings_collection.find_one({'key': key})
-        return setting['value'] if setting else default
-    except:
-        return default
+    return (await _fresh_settings()).get(key, default)
 
+@timed_db
 async def get_all_settings() -> Dict:
     """Get all settings"""
+    return dict(await _fresh_settings())
+
+def _int_setting(settings: Dict[str, Any], key: str, default: int) -> int:
+    # Stored values may be None or strings typed in by an admin
     try:
-        settings = await settings_collection.find({}).to_list(None)
-        return {s['key']: s['value'] for s in settings}
-    except:
-        return {}
+        return int(settings[key])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+@timed_db
+async def get_settings_snapshot() -> BotSettings:
+    """Get frequently used settings with defaults applied"""
+    settings = await _fresh_settings()
+    return BotSettings(
+        force_sub_enabled=bool(settings.get('force_sub_enabled', False)),
+        revoke_time=_int_setting(settings, 'revoke_time', DEFAULT_REVOKE_TIME),
+        delete_time=_int_setting(settings, 'delete_time', DEFAULT_DELETE_TIME),
+        button_text=settings.get('button_text') or DEFAULT_BUTTON_TEXT,
+        fsub_message=settings.get('fsub_message') or DEFAULT_FSUB_MESSAGE
+    )
 
 # ========== FORCE SUB MANAGEMENT ==========
+@timed_db
 async def add_fsub_channel(channel_id: int, request_mode: bool = False) -> bool:
     """Add force sub channel"""
     try:
@@ -313,6 +1163,7 @@ async def add_fsub_channel(channel_id: int, request_mode: bool = False) -> bool:
     except:
         return False
 
+@timed_db
 async def remove_fsub_channel(channel_id: int) -> bool:
     """Remove force sub channel"""
     try:
@@ -321,6 +1172,7 @@ async def remove_fsub_channel(channel_id: int) -> bool:
     except:
         return False
 
+@timed_db
 async def get_fsub_channels() -> List[Dict]:
     """Get all force sub channels"""
     try:
@@ -328,15 +1180,13 @@ async def get_fsub_channels() -> List[Dict]:
     except:
         return []
 
+@timed_db
 async def is_fsub_enabled() -> bool:
     """Check if force sub is enabled"""
-    try:
-        setting = await settings_collection.find_one({'key': 'force_sub_enabled'})
-        return setting['value'] if setting else False
-    except:
-        return False
+    return bool(await get_setting('force_sub_enabled', False))
 
 # ========== BACKUP MANAGEMENT ==========
+@timed_db
 async def create_backup(backup_data: Dict) -> str:
     """Create backup"""
     try:
@@ -351,28 +1201,321 @@ async def create_backup(backup_data: Dict) -> str:
     except:
         return ""
 
-# ========== STATISTICS ==========
-async def get_stats() -> Dict:
-    """Get bot statistics"""
+# ========== LEASES ==========
+# A lease makes one instance the owner of a named job. The fencing token only
+# increases when ownership changes hands, so a stale owner can tell it lost.
+
+@timed_db
+async def acquire_lease(name: str, owner: str, ttl: int) -> Optional[int]:
+    """Take a free or expired lease, returning the new fencing token"""
+    now = datetime.utcnow()
     try:
-        return {
-            'total_users': await count_users(),
-            'total_channels': await count_channels(),
-            'total_admins': await admins_collection.count_documents({}),
-            'active_links': await links_collection.count_documents({'status': 'active'}),
-            'bot_creation_date': BOT_CREATION_DATE,
-            'bot_age_days': (datetime.utcnow() - BOT_CREATION_DATE).days
-        }
+        lease = await leases_collection.find_one_and_update(
+            {'_id': name, 'expires_at': {'$lt': now}},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=ttl), 'acquired_at': now},
+             '$inc': {'token': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return lease['token']
+    except DuplicateKeyError:
+        # Lease exists and hasn't expired
+        return None
+    except Exception as e:
+        logger.error(f"Error acquiring lease {name}: {e}")
+        return None
+
+@timed_db
+async def renew_lease(name: str, owner: str, token: int, ttl: int) -> bool:
+    """Extend a lease we still hold"""
+    try:
+        result = await leases_collection.update_one(
+            {'_id': name, 'owner': owner, 'token': token},
+            {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}}
+        )
+        return result.matched_count > 0
+    except:
+        return False
+
+@timed_db
+async def release_lease(name: str, owner: str, token: int) -> bool:
+    """Expire a lease immediately so another instance can take over"""
+    try:
+        result = await leases_collection.update_one(
+            {'_id': name, 'owner': owner, 'token': token},
+            {'$set': {'expires_at': datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        return result.matched_count > 0
     except:
+        return False
+
+@timed_db
+async def get_leases() -> List[Dict]:
+    """Get all leases and their owners"""
+    try:
+        return await leases_collection.find({}).to_list(None)
+    except:
+        return []
+
+# ========== RETENTION ==========
+# Revoked links older than LINK_ARCHIVE_AFTER_DAYS are rolled into one
+# link_archive document per issue day, holding counts per channel and link
+# type, and then deleted. Each batch is counted and deleted together, so a
+# crash can at most count one batch twice.
+
+@timed_db
+async def archive_revoked_links(batch_size: int = RETENTION_BATCH) -> int:
+    """Summarise and delete old revoked links, returns how many were archived"""
+    cutoff = datetime.utcnow() - timedelta(days=LINK_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    while True:
+        links = await links_collection.find(
+            {'status': 'revoked', 'revoked_at': {'$lt': cutoff}},
+            {'channel_id': 1, 'link_type': 1, 'created_at': 1}
+        ).limit(batch_size).to_list(None)
+        if not links:
+            return archived
+
+        counts: Dict[Tuple[str, str], int] = {}
+        for link in links:
+            day = (link.get('created_at') or cutoff).strftime('%Y-%m-%d')
+            field = f"counts.{link.get('channel_id')}.{link.get('link_type') or 'unknown'}"
+            counts[(day, field)] = counts.get((day, field), 0) + 1
+        by_day: Dict[str, Dict[str, int]] = {}
+        for (day, field), n in counts.items():
+            by_day.setdefault(day, {'total': 0})[field] = n
+            by_day[day]['total'] += n
+        await link_archive_collection.bulk_write(
+            [UpdateOne({'_id': day}, {'$inc': fields}, upsert=True) for day, fields in by_day.items()],
+            ordered=False
+        )
+        await links_collection.delete_many({'_id': {'$in': [link['_id'] for link in links]}})
+        archived += len(links)
+        if len(links) < batch_size:
+            return archived
+
+@timed_db
+async def purge_deleted_channels() -> int:
+    """Remove channels deleted more than CHANNEL_RETENTION_DAYS ago"""
+    cutoff = datetime.utcnow() - timedelta(days=CHANNEL_RETENTION_DAYS)
+    try:
+        result = await channels_collection.delete_many({'status': 'deleted', 'deleted_at': {'$lt': cutoff}})
+        return result.deleted_count
+    except Exception as e:
+        logger.error(f"Error purging deleted channels: {e}")
+        return 0
+
+async def apply_retention() -> Dict[str, int]:
+    """Run every retention step once"""
+    try:
+        result = {'archived_links': await archive_revoked_links(),
+                  'purged_channels': await purge_deleted_channels()}
+    except Exception as e:
+        logger.error(f"Retention run failed: {e}")
         return {}
+    if any(result.values()):
+        logger.info(f"Retention: archived {result['archived_links']} links, "
+                    f"purged {result['purged_channels']} deleted channels")
+    return result
+
+@timed_db
+async def get_link_archive(days: int = 30) -> List[Dict]:
+    """Get per-day link summaries, oldest first"""
+    since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+    try:
+        return await link_archive_collection.reads.find({'_id': {'$gte': since}}).sort('_id', 1).to_list(None)
+    except:
+        return []
+
+# ========== PAGINATION ==========
+# Keyset pagination: each page is one indexed query for limit+1 documents
+# after (or before) the boundary document named by an opaque token, so page
+# cost doesn't grow with collection size. Tokens only carry the boundary _id
+# to stay well inside Telegram's 64-byte callback data.
+
+def _encode_page_token(direction: str, doc_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{direction}{doc_id}".encode()).decode().rstrip('=')
+
+def _decode_page_token(token: str) -> Tuple[str, int]:
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    return raw[0], int(raw[1:])
 
-# ========== HELPER FUNCTIONS ==========
-async def encode_string(text: str) -> str:
-    """Base64 encode string"""
-    return base64.urlsafe_b64encode(text.encode()).decode().strip('=')
+async def _keyset_page(collection, query: Dict, sort_field: str, token: Optional[str],
+                       limit: int) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    direction, boundary = 'n', None
+    if token:
+        try:
+            direction, boundary_id = _decode_page_token(token)
+            boundary = await collection.reads.find_one({'_id': boundary_id}, {sort_field: 1})
+        except Exception:
+            boundary = None
+        if boundary is None:
+            direction = 'n'
 
-async def decode_string(encoded: str) -> str:
-    """Base64 decode string"""
-    padding = 4 - (len(encoded) % 4)
-    encoded += '=' * padding
-    return base64.urlsafe_b64decode(encoded.encode()).decode()
+    forward = direction == 'n'
+    op = '$gt' if forward else '$lt'
+    order = 1 if forward else -1
+    filters = dict(query)
+    if boundary is not None:
+        if sort_field == '_id':
+            filters['_id'] = {op: boundary['_id']}
+        else:
+            value = boundary.get(sort_field)
+            filters['$or'] = [
+                {sort_field: {op: value}},
+                {sort_field: value, '_id': {op: boundary['_id']}}
+            ]
+    sort = [('_id', order)] if sort_field == '_id' else [(sort_field, order), ('_id', order)]
+
+    docs = await collection.reads.find(filters).sort(sort).limit(limit + 1).to_list(None)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if not forward:
+        docs.reverse()
+    if not docs:
+        return [], None, None
+
+    if forward:
+        prev_token = _encode_page_token('p', docs[0]['_id']) if boundary is not None else None
+        next_token = _encode_page_token('n', docs[-1]['_id']) if has_more else None
+    else:
+        prev_token = _encode_page_token('p', docs[0]['_id']) if has_more else None
+        next_token = _encode_page_token('n', docs[-1]['_id'])
+    return docs, prev_token, next_token
+
+@timed_db
+async def backfill_channel_names() -> int:
+    """Give channels saved without a name an empty one so name paging can order them"""
+    try:
+        result = await channels_collection.update_many(
+            {'anime_name': {'$not': {'$type': 'string'}}},
+            {'$set': {'anime_name': ''}}
+        )
+        return result.modified_count
+    except Exception as e:
+        logger.error(f"Error backfilling channel names: {e}")
+        return 0
+
+@timed_db
+async def get_channels_page(token: str = None, limit: int = 10,
+                            sort_by: str = 'anime_name') -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """Get one page of active channels as (channels, prev_token, next_token)"""
+    try:
+        return await _keyset_page(channels_collection, {'status': 'active'}, sort_by, token, limit)
+    except Exception as e:
+        logger.error(f"Error paging channels: {e}")
+        return [], None, None
+
+@timed_db
+async def get_admins_page(token: str = None, limit: int = 10) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """Get one page of admins as (admins, prev_token, next_token)"""
+    try:
+        return await _keyset_page(admins_collection, {}, '_id', token, limit)
+    except Exception as e:
+        logger.error(f"Error paging admins: {e}")
+        return [], None, None
+
+# ========== STATISTICS ==========
+# get_stats() serves a snapshot refreshed by run_stats_refresher(). Writes in
+# this module adjust it in between, and bump per-day counters that are
+# flushed into daily_stats_collection with one $inc per day.
+_stats_snapshot: Dict[str, int] = {'total_users': 0, 'total_channels': 0, 'total_admins': 0, 'active_links': 0}
+_stats_deltas: Dict[str, int] = {}
+_stats_refreshed_at: Optional[datetime] = None
+_daily_pending: Dict[str, Dict[str, int]] = {}
+
+def _record_stat(total: str = None, daily: str = None, n: int = 1, daily_n: int = None):
+    """Adjust a running total and/or today's counter"""
+    if total and n:
+        _stats_deltas[total] = _stats_deltas.get(total, 0) + n
+    if daily:
+        day = _daily_pending.setdefault(datetime.utcnow().strftime('%Y-%m-%d'), {})
+        day[daily] = day.get(daily, 0) + (n if daily_n is None else daily_n)
+
+@timed_db
+async def refresh_stats() -> Dict:
+    """Recount totals concurrently"""
+    global _stats_snapshot, _stats_refreshed_at
+    # Deltas recorded from here on may be missing from the counts; keep them
+    counted = dict(_stats_deltas)
+    try:
+        users, channels, admins, links = await asyncio.gather(
+            users_collection.reads.estimated_document_count(),
+            channels_collection.reads.count_documents({'status': 'active'}),
+            admins_collection.reads.estimated_document_count(),
+            links_collection.reads.count_documents({'status': 'active'})
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing stats: {e}")
+        return _stats_snapshot
+    _stats_snapshot = {
+        'total_users': users,
+        'total_channels': channels,
+        'total_admins': admins,
+        'active_links': links
+    }
+    for key, n in counted.items():
+        remaining = _stats_deltas.get(key, 0) - n
+        if remaining:
+            _stats_deltas[key] = remaining
+        else:
+            _stats_deltas.pop(key, None)
+    _stats_refreshed_at = datetime.utcnow()
+    return _stats_snapshot
+
+@timed_db
+async def flush_daily_stats() -> int:
+    """Write pending per-day counters"""
+    global _daily_pending
+    pending, _daily_pending = _daily_pending, {}
+    for day, counters in pending.items():
+        try:
+            await daily_stats_collection.update_one(
+                {'_id': day},
+                {'$inc': counters},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error saving daily stats for {day}: {e}")
+            for key, value in counters.items():
+                _daily_pending.setdefault(day, {})
+                _daily_pending[day][key] = _daily_pending[day].get(key, 0) + value
+    return len(pending)
+
+async def run_stats_refresher():
+    """Refresh the stats snapshot and flush daily counters periodically"""
+    while True:
+        await refresh_stats()
+        await flush_daily_stats()
+        await asyncio.sleep(STATS_REFRESH_INTERVAL)
+
+@timed_db
+async def get_daily_stats(days: int = 7) -> List[Dict]:
+    """Get new users, links issued and links revoked per day, oldest first"""
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    try:
+        stats = await daily_stats_collection.reads.find({'_id': {'$gte': since}}).sort('_id', 1).to_list(None)
+    except:
+        stats = []
+    # Include today's counts that haven't been flushed yet
+    by_day = {s['_id']: s for s in stats}
+    for day, counters in _daily_pending.items():
+        if day >= since:
+            entry = by_day.setdefault(day, {'_id': day})
+            for key, value in counters.items():
+                entry[key] = entry.get(key, 0) + value
+    return [{'date': day, 'new_users': s.get('new_users', 0), 'links_issued': s.get('links_issued', 0),
+             'links_revoked': s.get('links_revoked', 0)} for day, s in sorted(by_day.items())]
+
+@timed_db
+async def get_stats() -> Dict:
+    """Get bot statistics"""
+    if _stats_refreshed_at is None:
+        await refresh_stats()
+    stats = {key: max(value + _stats_deltas.get(key, 0), 0) for key, value in _stats_snapshot.items()}
+    stats.update({
+        'bot_creation_date': BOT_CREATION_DATE,
+        'bot_age_days': (datetime.utcnow() - BOT_CREATION_DATE).days,
+        'updated_at': _stats_refreshed_at
+    })
+    return stats
@@ -1,16 +1,27 @@
 import base64
+import binascii
+import calendar
+import hashlib
+import hmac
 import re
 import asyncio
-import psutil
+import struct
 import time
 from datetime import datetime, timedelta
-from typing import Tuple, List, Dict, Optional
+from functools import lru_cache
+from typing import NamedTuple, Tuple, List, Dict, Optional, Union
 from pyrogram import filters
 from pyrogram.enums import ChatMemberStatus, ChatType
 from pyrogram.errors import UserNotParticipant, FloodWait
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
-from config import ADMINS, OWNER_ID
-from database import is_admin
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, ChatMemberUpdated
+from config import (LOGGER, ADMINS, OWNER_ID, TG_BOT_TOKEN, FSUB_CHECK_CONCURRENCY, FSUB_POSITIVE_TTL,
+                    FSUB_NEGATIVE_TTL, FSUB_MAX_FLOOD_WAIT, LINK_TOKEN_SECRET, LINK_TOKEN_CACHE_SIZE,
+                    CHANNEL_INFO_TTL, CHANNEL_INFO_NEGATIVE_TTL)
+from database import is_admin, get_fsub_channels
+from monitor import system_sampler
+from ratelimit import flood_sleep_limit
+
+logger = LOGGER(__name__)
 
 # ========== FILTERS ==========
 class IsAdmin(filters.Filter):
@@ -28,13 +39,13 @@ is_owner_or_admin = IsOwnerOrAdmin()
 
 # ========== ENCODING/DECODING ==========
 def encode_string(string: str) -> str:
-    """Base64 encode string for URLs"""
+    """Base64 encode string for URLs (legacy unsigned links)"""
     string_bytes = string.encode("ascii")
     base64_bytes = base64.urlsafe_b64encode(string_bytes)
     return (base64_bytes.decode("ascii")).strip("=")
 
 def decode_string(base64_string: str) -> str:
-    """Base64 decode string from URL"""
+    """Base64 decode string from URL (legacy unsigned links)"""
     base64_string = base64_string.strip("=")
     padding = 4 - (len(base64_string) % 4)
     base64_string += "=" * padding
@@ -42,6 +53,65 @@ def decode_string(base64_string: str) -> str:
     string_bytes = base64.urlsafe_b64decode(base64_bytes)
     return string_bytes.decode("ascii")
 
+# ========== DEEP LINK TOKENS ==========
+# Token = base64url(channel_id int64 | link type uint8 | expiry uint32 | HMAC-SHA256[:8]).
+# 21 bytes encode to 28 characters, well inside Telegram's 64-character
+# start parameter, and validation needs no database lookup.
+
+LINK_TYPES = {'normal': 0, 'request': 1}
+_LINK_TYPE_NAMES = {code: name for name, code in LINK_TYPES.items()}
+_TOKEN_BODY = struct.Struct(">qBI")
+_TOKEN_MAC_SIZE = 8
+_TOKEN_LENGTH = 28
+_TOKEN_KEY = (LINK_TOKEN_SECRET or hashlib.sha256(b"deep-link:" + TG_BOT_TOKEN.encode()).hexdigest()).encode()
+# Keyed once; copying skips re-deriving the inner and outer pads on every token
+_TOKEN_HMAC = hmac.new(_TOKEN_KEY, digestmod=hashlib.sha256)
+
+class LinkToken(NamedTuple):
+    channel_id: int
+    link_type: str
+    expires_at: int  # Unix timestamp, 0 for never
+
+def _sign(body: bytes) -> bytes:
+    mac = _TOKEN_HMAC.copy()
+    mac.update(body)
+    return mac.digest()[:_TOKEN_MAC_SIZE]
+
+def encode_link_token(channel_id: int, link_type: str = 'normal',
+                      expires_at: Union[datetime, int, None] = None) -> str:
+    """Build a signed /start token for a channel link.
+
+    A naive expires_at is taken as UTC, like every datetime stored by this bot.
+    """
+    if isinstance(expires_at, datetime):
+        expires_at = calendar.timegm(expires_at.utctimetuple())
+    body = _TOKEN_BODY.pack(channel_id, LINK_TYPES[link_type], expires_at or 0)
+    return base64.urlsafe_b64encode(body + _sign(body)).decode("ascii").rstrip("=")
+
+@lru_cache(maxsize=LINK_TOKEN_CACHE_SIZE)
+def _verify_link_token(token: str) -> Optional[LinkToken]:
+    if len(token) != _TOKEN_LENGTH:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=")
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) != _TOKEN_BODY.size + _TOKEN_MAC_SIZE:
+        return None
+    body, mac = raw[:-_TOKEN_MAC_SIZE], raw[-_TOKEN_MAC_SIZE:]
+    if not hmac.compare_digest(mac, _sign(body)):
+        return None
+    channel_id, type_code, expires_at = _TOKEN_BODY.unpack(body)
+    link_type = _LINK_TYPE_NAMES.get(type_code)
+    return LinkToken(channel_id, link_type, expires_at) if link_type else None
+
+def decode_link_token(token: str) -> Optional[LinkToken]:
+    """Verify a /start token, None if forged, malformed or expired"""
+    link = _verify_link_token(token)
+    if link is None or (link.expires_at and link.expires_at < time.time()):
+        return None
+    return link
+
 # ========== TIME FUNCTIONS ==========
 def get_readable_time(seconds: int) -> str:
     """Convert seconds to readable time"""
@@ -99,26 +169,25 @@ def format_timedelta(td: timedelta) -> str:
     return " ".join(parts) if parts else "0s"
 
 # ========== SYSTEM STATUS ==========
+# The keys the status text has always used; the sampler also records
+# process and loop metrics, served by get_system_summary()
+SYSTEM_STATUS_KEYS = ('cpu', 'ram', 'ram_used', 'ram_total', 'disk_used', 'disk_total', 'disk_percent')
+
 def get_system_status() -> Dict:
-    """Get system status (CPU, RAM, etc.)"""
+    """Get system status (CPU, RAM, etc.) from the latest background sample"""
     try:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
-        return {
-            'cpu': round(cpu_percent, 1),
-            'ram': round(memory.percent, 1),
-            'ram_used': round(memory.used / (1024**3), 1),  # GB
-            'ram_total': round(memory.total / (1024**3), 1),  # GB
-            'disk_used': round(disk.used / (1024**3), 1),  # GB
-            'disk_total': round(disk.total / (1024**3), 1),  # GB
-            'disk_percent': round(disk.percent, 1)
-        }
+        sample = system_sampler.latest()
+        if sample is None:
+            sample = system_sampler.collect(0.0)
+        return {key: sample.get(key, 0) for key in SYSTEM_STATUS_KEYS}
     except:
         return {'cpu': 0, 'ram': 0, 'ram_used': 0, 'ram_total': 0, 
                 'disk_used': 0, 'disk_total': 0, 'disk_percent': 0}
 
+def get_system_summary(minutes: int = 5) -> Dict[str, Dict[str, float]]:
+    """Get min/avg/max system metrics over the last N minutes"""
+    return system_sampler.summary(minutes)
+
 # ========== TEXT FORMATTING ==========
 def escape_markdown(text: str) -> str:
     """Escape markdown characters"""
@@ -151,6 +220,16 @@ def create_nav_buttons(current_page: int, total_pages: int,
     
     return buttons
 
+def create_keyset_nav_buttons(prev_token: Optional[str], next_token: Optional[str],
+                              prefix: str = "page") -> List[List[InlineKeyboardButton]]:
+    """Create navigation buttons carrying keyset page tokens"""
+    row = []
+    if prev_token:
+        row.append(InlineKeyboardButton("◀️ Previous", callback_data=f"{prefix}_{prev_token}"))
+    if next_token:
+        row.append(InlineKeyboardButton("Next ▶️", callback_data=f"{prefix}_{next_token}"))
+    return [row] if row else []
+
 def create_close_button() -> List[List[InlineKeyboardButton]]:
     """Create close button"""
     return [[InlineKeyboardButton("❌ Close", callback_data="close")]]
@@ -181,12 +260,12 @@ def is_valid_url(url: str) -> bool:
 
 # ========== MESSAGE UTILITIES ==========
 async def delete_message_after(message: Message, seconds: int) -> None:
-    """Delete message after specified seconds"""
-    await asyncio.sleep(seconds)
-    try:
-        await message.delete()
-    except:
-        pass
+    """Queue message for deletion after specified seconds"""
+    await delete_messages_after(message._client, message.chat.id, [message.id], seconds)
+
+async def delete_messages_after(client, chat_id: int, message_ids: List[int], seconds: int) -> None:
+    """Queue several messages of one chat for deletion after specified seconds"""
+    await client.message_deleter.queue(chat_id, message_ids, seconds)
 
 async def edit_or_reply(message: Message, text: str, **kwargs) -> Message:
     """Edit message or reply if can't edit"""
@@ -195,32 +274,98 @@ async def edit_or_reply(message: Message, text: str, **kwargs) -> Message:
     except:
         return await message.reply_text(text, **kwargs)
 
+# ========== CHANNEL METADATA CACHE ==========
+# The bot's own identity is client.me (set by Client.start). Channel title,
+# type and the bot's rights there are cached per channel, replaced whenever a
+# ChatMemberUpdated about the bot arrives and otherwise refetched after
+# CHANNEL_INFO_TTL.
+
+class ChannelInfo(NamedTuple):
+    title: Optional[str]
+    type: Optional[ChatType]
+    status: Optional[ChatMemberStatus]  # None if the bot isn't a member
+    can_invite_users: bool
+    error: Optional[str] = None
+
+# chat_id -> (info, expires_at monotonic)
+_channel_cache: Dict[int, Tuple[ChannelInfo, float]] = {}
+
+def _member_info(chat, member) -> ChannelInfo:
+    status = member.status if member else None
+    privileges = member.privileges if member else None
+    # An admin whose privileges weren't reported is assumed able to invite
+    can_invite = (status == ChatMemberStatus.OWNER
+                  or (status == ChatMemberStatus.ADMINISTRATOR
+                      and (privileges is None or bool(privileges.can_invite_users))))
+    return ChannelInfo(chat.title, chat.type, status, can_invite)
+
+async def get_bot_identity(client):
+    """The bot's own User, fetched once at startup"""
+    if getattr(client, 'me', None) is None:
+        client.me = await client.get_me()
+    return client.me
+
+async def get_channel_info(client, chat_id: int, refresh: bool = False) -> ChannelInfo:
+    """Get cached channel metadata and the bot's rights there"""
+    cached = _channel_cache.get(chat_id)
+    if cached and not refresh and cached[1] > time.monotonic():
+        return cached[0]
+
+    me = await get_bot_identity(client)
+    chat, member = await asyncio.gather(client.get_chat(chat_id), client.get_chat_member(chat_id, me.id),
+                                        return_exceptions=True)
+    if isinstance(chat, Exception):
+        info, ttl = ChannelInfo(None, None, None, False, str(chat)), CHANNEL_INFO_NEGATIVE_TTL
+    elif isinstance(member, Exception):
+        # Not a member (or no rights to look), which the checks below report
+        info, ttl = _member_info(chat, None), CHANNEL_INFO_NEGATIVE_TTL
+    else:
+        info, ttl = _member_info(chat, member), CHANNEL_INFO_TTL
+    _channel_cache[chat_id] = (info, time.monotonic() + ttl)
+    return info
+
+def invalidate_channel_info(chat_id: int = None) -> None:
+    """Forget cached metadata for one channel, or all of them"""
+    if chat_id is None:
+        _channel_cache.clear()
+    else:
+        _channel_cache.pop(chat_id, None)
+
+async def on_bot_member_updated(client, update: ChatMemberUpdated):
+    """Keep the channel cache current when the bot is promoted, demoted or removed"""
+    me = await get_bot_identity(client)
+    member = update.new_chat_member
+    if member and member.user and member.user.id == me.id:
+        in_chat = member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+        _channel_cache[update.chat.id] = (_member_info(update.chat, member if in_chat else None),
+                                          time.monotonic() + CHANNEL_INFO_TTL)
+
 # ========== CHAT PERMISSION CHECK ==========
 async def check_bot_permissions(client, chat_id: int) -> Tuple[bool, str]:
     """Check if bot has necessary permissions in chat"""
-    try:
-        chat = await client.get_chat(chat_id)
-        
-        # Check if bot is admin
-        try:
-            bot_member = await client.get_chat_member(chat_id, (await client.get_me()).id)
-            if bot_member.status not in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-                return False, "Bot is not admin in the channel"
-        except:
-            return False, "Bot is not a member of the channel"
-        
-        # Check invite link permission
-        if bot_member.privileges and not bot_member.privileges.can_invite_users:
-            return False, "Bot doesn't have invite link permission"
-        
-        return True, "All permissions OK"
-    
-    except Exception as e:
-        return False, f"Error checking permissions: {str(e)}"
+    info = await get_channel_info(client, chat_id)
+    if info.error:
+        return False, f"Error checking permissions: {info.error}"
+    if info.status is None:
+        return False, "Bot is not a member of the channel"
+    if info.status not in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
+        return False, "Bot is not admin in the channel"
+    if not info.can_invite_users:
+        return False, "Bot doesn't have invite link permission"
+    return True, "All permissions OK"
 
 async def create_invite_link(client, chat_id: int, creates_join_request: bool = False, 
                             expire_date: datetime = None) -> Optional[str]:
-    """Create invite link with error handling"""
+    """Create invite link with error handling.
+
+    Without expire_date the link comes from the client's pre-minted pool when
+    it has one, and is only minted live when the pool is dry.
+    """
+    pool = getattr(client, 'link_pool', None)
+    if pool is not None and expire_date is None:
+        link = pool.get(chat_id, creates_join_request)
+        if link:
+            return link
     try:
         invite = await client.create_chat_invite_link(
             chat_id=chat_id,
@@ -230,9 +375,65 @@ async def create_invite_link(client, chat_id: int, creates_join_request: bool =
         )
         return invite.invite_link
     except Exception as e:
-        print(f"Error creating invite link: {e}")
+        # Our cached rights may be stale; look again on the next check
+        invalidate_channel_info(chat_id)
+        logger.error(f"Error creating invite link: {e}")
         return None
 
+# ========== FORCE SUB CHECK ==========
+# (channel_id, user_id) -> (is_member, expires_at monotonic)
+_fsub_cache: Dict[Tuple[int, int], Tuple[bool, float]] = {}
+_fsub_semaphore = asyncio.Semaphore(FSUB_CHECK_CONCURRENCY)
+_FSUB_CACHE_MAX = 100000
+
+async def is_channel_member(client, channel_id: int, user_id: int) -> bool:
+    """Check channel membership, using cached results when fresh"""
+    now = time.monotonic()
+    cached = _fsub_cache.get((channel_id, user_id))
+    if cached and cached[1] > now:
+        return cached[0]
+
+    async with _fsub_semaphore:
+        try:
+            # invoke() sleeps through short FloodWaits and raises longer ones
+            with flood_sleep_limit(FSUB_MAX_FLOOD_WAIT):
+                member = await client.get_chat_member(channel_id, user_id)
+            joined = (member.status in [ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR,
+                                        ChatMemberStatus.MEMBER]
+                      or (member.status == ChatMemberStatus.RESTRICTED and member.is_member))
+        except UserNotParticipant:
+            joined = False
+        except FloodWait:
+            # Don't lock users out because Telegram is throttling us
+            return True
+        except Exception as e:
+            logger.error(f"Error checking membership of {user_id} in {channel_id}: {e}")
+            return True
+
+    if len(_fsub_cache) >= _FSUB_CACHE_MAX:
+        for key in [k for k, (_, expires) in _fsub_cache.items() if expires <= now]:
+            del _fsub_cache[key]
+        if len(_fsub_cache) >= _FSUB_CACHE_MAX:
+            _fsub_cache.clear()
+    ttl = FSUB_POSITIVE_TTL if joined else FSUB_NEGATIVE_TTL
+    _fsub_cache[(channel_id, user_id)] = (joined, time.monotonic() + ttl)
+    return joined
+
+async def get_unjoined_channels(client, user_id: int) -> List[Dict]:
+    """Get force sub channels the user hasn't joined, checked concurrently"""
+    channels = await get_fsub_channels()
+    joined = await asyncio.gather(*(is_channel_member(client, channel['_id'], user_id)
+                                    for channel in channels))
+    return [channel for channel, ok in zip(channels, joined) if not ok]
+
+def invalidate_fsub_cache(user_id: int, channel_id: int = None) -> None:
+    """Forget cached membership, e.g. after the user joins a channel"""
+    if channel_id is not None:
+        _fsub_cache.pop((channel_id, user_id), None)
+        return
+    for key in [k for k in _fsub_cache if k[1] == user_id]:
+        del _fsub_cache[key]
+
 # ========== PAGINATION ==========
 def paginate_list(items: List, page: int, per_page: int = 10) -> Tuple[List, int]:
     """Paginate list of items"""
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+from config import LOGGER, INSTANCE_ID, LEASE_TTL, LEASE_RENEW_INTERVAL
+from database import acquire_lease, renew_lease, release_lease
+
+logger = LOGGER(__name__)
+
+# ========== LEASE ==========
+class Lease:
+    """Mongo-backed lease that makes one instance the owner of a job.
+
+    A heartbeat task renews the lease every LEASE_RENEW_INTERVAL seconds, or
+    tries to take it over once the previous owner stops renewing. Ownership
+    is only trusted locally until the last renewal plus the TTL (minus one
+    renew interval of margin), so an instance that stalls gives up before
+    another can acquire.
+    """
+
+    def __init__(self, name: str, owner: str = INSTANCE_ID, ttl: int = LEASE_TTL,
+                 renew_interval: int = LEASE_RENEW_INTERVAL):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.token: Optional[int] = None
+        self._valid_until = 0.0
+        self._task = None
+
+    @property
+    def is_held(self) -> bool:
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    async def try_acquire(self) -> bool:
+        """Acquire or renew once, return whether we own the lease"""
+        started = time.monotonic()
+        if self.token is not None and await renew_lease(self.name, self.owner, self.token, self.ttl):
+            self._valid_until = started + self.ttl - self.renew_interval
+            return True
+        if self.token is not None:
+            logger.warning(f"Lost lease {self.name} (token {self.token})")
+            self.token = None
+
+        token = await acquire_lease(self.name, self.owner, self.ttl)
+        if token is None:
+            return False
+        self.token = token
+        self._valid_until = started + self.ttl - self.renew_interval
+        logger.info(f"Acquired lease {self.name} with token {token}")
+        return True
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.token is not None:
+            await release_lease(self.name, self.owner, self.token)
+            self.token = None
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self.try_acquire()
+            except Exception as e:
+                logger.error(f"Lease {self.name} heartbeat error: {e}")
+            await asyncio.sleep(self.renew_interval)
+
+async def run_leader_job(lease: Lease, interval: int, job: Callable[[], Awaitable[None]]):
+    """Run job every interval seconds, but only while this instance holds the lease"""
+    while True:
+        await asyncio.sleep(interval)
+        if not lease.is_held:
+            continue
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Leader job {lease.name} error: {e}")
@@ -0,0 +1,251 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from pyrogram.errors import FloodWait
+from config import (LOGGER, INSTANCE_ID, DEFAULT_REVOKE_TIME, LINK_POOL_SIZE, LINK_POOL_LOW_WATER,
+                    LINK_POOL_LINK_TTL, LINK_POOL_SWEEP_INTERVAL)
+from database import (add_channel_listener, save_pooled_link, renew_pooled_links,
+                      get_orphaned_pooled_links, remove_pooled_links)
+from ratelimit import set_api_lane, flood_sleep_limit
+
+logger = LOGGER(__name__)
+
+# (channel_id, creates_join_request)
+PoolKey = Tuple[int, bool]
+
+# First retry of a failed refill; doubles per failure up to the sweep interval
+REFILL_RETRY_DELAY = 5
+# Links per key whose records are already cleared, so get() hands them out
+# without a database write. If the process dies, at most this many per key
+# stay usable until Telegram expires them.
+READY_LINKS = 2
+
+# ========== INVITE LINK POOL ==========
+class InviteLinkPool:
+    """Pre-minted single-use invite links per channel and link type.
+
+    A channel's pool is filled the first time a link for it is asked for, and
+    topped up by a background task whenever it drops below the low-water
+    mark. The same task revokes links that would expire before a user could
+    use them for the full revoke time. Pooled links are recorded in Mongo, so
+    links left behind by a crash are revoked on the next start (or by another
+    instance's sweep). The task clears the records of the next READY_LINKS
+    links per key ahead of time; get() only hands out those, so it never
+    waits on Mongo and a link a user holds is never revoked as an orphan.
+    """
+
+    def __init__(self, client, size: int = LINK_POOL_SIZE, low_water: int = LINK_POOL_LOW_WATER,
+                 link_ttl: int = LINK_POOL_LINK_TTL):
+        self.client = client
+        self.size = size
+        self.low_water = low_water
+        self.link_ttl = link_ttl
+        self._pools: Dict[PoolKey, Deque[Tuple[str, datetime]]] = {}
+        self._ready: Dict[PoolKey, Deque[Tuple[str, datetime]]] = {}
+        self._release_retry_at: Optional[float] = None
+        self._needs_refill: Set[PoolKey] = set()
+        self._failures: Dict[PoolKey, int] = {}
+        self._retry_at: Dict[PoolKey, float] = {}
+        self._retired: List[Tuple[int, str]] = []
+        self._removed: Set[int] = set()
+        self._next_sweep = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.stats = {'hits': 0, 'misses': 0, 'minted': 0, 'recycled': 0}
+
+    async def start(self) -> int:
+        """Start the pool; returns how many links left pooled by earlier runs will be revoked"""
+        add_channel_listener(self._on_channel_change)
+        orphans = await get_orphaned_pooled_links(INSTANCE_ID)
+        self._retired.extend((link['channel_id'], link['_id']) for link in orphans)
+        self._next_sweep = time.monotonic() + LINK_POOL_SWEEP_INTERVAL
+        self._task = asyncio.create_task(self._run())
+        return len(orphans)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def register(self, channel_id: int):
+        """Allow pooling links for a channel again; its pools fill on the first get()"""
+        self._removed.discard(channel_id)
+
+    def unregister(self, channel_id: int):
+        """Stop keeping links for a channel and revoke the ones already minted"""
+        self._removed.add(channel_id)
+        for creates_join_request in (False, True):
+            key = (channel_id, creates_join_request)
+            for invite_link, _ in (*self._pools.pop(key, ()), *self._ready.pop(key, ())):
+                self._retired.append((channel_id, invite_link))
+            self._needs_refill.discard(key)
+            self._failures.pop(key, None)
+            self._retry_at.pop(key, None)
+        self._wakeup.set()
+
+    def _on_channel_change(self, channel_id: int, active: bool):
+        if active:
+            self.register(channel_id)
+        else:
+            self.unregister(channel_id)
+
+    def get(self, channel_id: int, creates_join_request: bool = False,
+            min_lifetime: int = DEFAULT_REVOKE_TIME) -> Optional[str]:
+        """Pop a link valid for at least min_lifetime seconds, or None if the pool is dry"""
+        if channel_id in self._removed:
+            self.stats['misses'] += 1
+            return None
+        key = (channel_id, creates_join_request)
+        if key not in self._pools:
+            self._pools[key] = deque()
+            self._ready[key] = deque()
+        ready = self._ready[key]
+
+        deadline = datetime.utcnow() + timedelta(seconds=min_lifetime)
+        link = None
+        while ready:
+            invite_link, expires_at = ready.popleft()
+            if expires_at > deadline:
+                link = invite_link
+                break
+            # Too close to expiry for this caller; the sweep would revoke it anyway
+            self._retired.append((channel_id, invite_link))
+
+        if self._size(key) < self.low_water and key not in self._retry_at:
+            self._needs_refill.add(key)
+        # Clear the records of the next links to hand out
+        self._wakeup.set()
+        self.stats['hits' if link else 'misses'] += 1
+        return link
+
+    def pool_sizes(self) -> Dict[PoolKey, int]:
+        return {key: self._size(key) for key in self._pools}
+
+    def _size(self, key: PoolKey) -> int:
+        return len(self._pools[key]) + len(self._ready[key])
+
+    async def _run(self):
+        set_api_lane('background')
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._next_sweep = now + LINK_POOL_SWEEP_INTERVAL
+                try:
+                    await self._sweep()
+                except Exception as e:
+                    logger.error(f"Invite link pool sweep failed: {e}")
+            for key, retry_at in list(self._retry_at.items()):
+                if retry_at <= now:
+                    del self._retry_at[key]
+                    self._needs_refill.add(key)
+
+            await self._revoke_retired()
+            while self._needs_refill:
+                key = self._needs_refill.pop()
+                try:
+                    # Back off through _retry_at rather than sleeping while other keys wait
+                    with flood_sleep_limit(0):
+                        await self._refill(key)
+                    self._failures.pop(key, None)
+                except FloodWait as e:
+                    self._retry_at[key] = time.monotonic() + e.value + 1
+                except Exception as e:
+                    failures = self._failures[key] = self._failures.get(key, 0) + 1
+                    delay = min(REFILL_RETRY_DELAY * 2 ** (failures - 1), LINK_POOL_SWEEP_INTERVAL)
+                    self._retry_at[key] = time.monotonic() + delay
+                    logger.error(f"Invite link pool refill for {key[0]} failed {failures} times, "
+                                 f"retrying in {delay}s: {e}")
+
+            if self._release_retry_at is None or time.monotonic() >= self._release_retry_at:
+                await self._release()
+
+            wake_at = min([self._next_sweep, *self._retry_at.values()]
+                          + ([self._release_retry_at] if self._release_retry_at is not None else []))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(wake_at - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self, key: PoolKey):
+        channel_id, creates_join_request = key
+        while key in self._pools and self._size(key) < self.size:
+            expires_at = datetime.utcnow() + timedelta(seconds=self.link_ttl)
+            invite = await self.client.create_chat_invite_link(
+                chat_id=channel_id,
+                expire_date=expires_at,
+                creates_join_request=creates_join_request,
+                member_limit=None if creates_join_request else 1
+            )
+            if key not in self._pools:
+                # Channel was deleted while we were minting
+                await self._revoke(channel_id, invite.invite_link)
+                break
+            saved = await save_pooled_link(invite.invite_link, channel_id,
+                                           'request' if creates_join_request else 'normal',
+                                           expires_at, INSTANCE_ID, self._held_until())
+            if not saved:
+                # An unrecorded link would leak if we crashed; don't hand it out
+                await self._revoke(channel_id, invite.invite_link)
+                raise RuntimeError("could not record pooled link")
+            self._pools[key].append((invite.invite_link, expires_at))
+            self.stats['minted'] += 1
+
+    async def _sweep(self):
+        """Retire links that can no longer serve a full revoke window and collect orphans"""
+        cutoff = datetime.utcnow() + timedelta(seconds=DEFAULT_REVOKE_TIME + LINK_POOL_SWEEP_INTERVAL)
+        for key, pool in self._pools.items():
+            for links in (self._ready[key], pool):
+                while links and links[0][1] <= cutoff:
+                    invite_link, _ = links.popleft()
+                    self._retired.append((key[0], invite_link))
+            if self._size(key) < self.low_water and key not in self._retry_at:
+                self._needs_refill.add(key)
+        await renew_pooled_links(INSTANCE_ID, self._held_until())
+        # Links of instances that stopped renewing them
+        self._retired.extend((link['channel_id'], link['_id']) for link in await get_orphaned_pooled_links())
+
+    def _held_until(self) -> datetime:
+        # Two missed sweeps before other instances treat our links as orphaned
+        return datetime.utcnow() + timedelta(seconds=2 * LINK_POOL_SWEEP_INTERVAL + 60)
+
+    async def _release(self):
+        """Move links into the ready queues once their records are cleared"""
+        moving = []
+        for key, pool in self._pools.items():
+            for _ in range(min(READY_LINKS - len(self._ready[key]), len(pool))):
+                moving.append((key, pool.popleft()))
+        if not moving:
+            return
+        if await remove_pooled_links([invite_link for _, (invite_link, _) in moving]):
+            self._release_retry_at = None
+            for key, link in moving:
+                if key in self._pools:
+                    self._ready[key].append(link)
+                else:
+                    # Channel was deleted while we were clearing
+                    self._retired.append((key[0], link[0]))
+            return
+        # Still recorded, so not safe to hand out; put them back and retry shortly
+        self._release_retry_at = time.monotonic() + REFILL_RETRY_DELAY
+        logger.warning(f"Could not clear {len(moving)} pooled link records, retrying in {REFILL_RETRY_DELAY}s")
+        for key, link in reversed(moving):
+            if key in self._pools:
+                self._pools[key].appendleft(link)
+            else:
+                self._retired.append((key[0], link[0]))
+
+    async def _revoke_retired(self):
+        retired, self._retired = self._retired, []
+        for channel_id, invite_link in retired:
+            await self._revoke(channel_id, invite_link)
+        await remove_pooled_links([invite_link for _, invite_link in retired])
+
+    async def _revoke(self, channel_id: int, invite_link: str):
+        try:
+            await self.client.revoke_chat_invite_link(channel_id, invite_link)
+        except Exception:
+            pass
+        self.stats['recycled'] += 1
@@ -1,9 +1,27 @@
 import asyncio
+import inspect
 import logging
+import time
 from datetime import datetime
-from pyrogram import Client
+from pyrogram import Client, filters
 from pyrogram.enums import ParseMode
-from config import API_HASH, APP_ID, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, PORT, OWNER_ID
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.handlers import ChatMemberUpdatedHandler, MessageHandler
+from config import (API_HASH, APP_ID, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, PORT, OWNER_ID,
+                    HEALTH_MAX_LOOP_LAG, RETENTION_INTERVAL, LINK_SWEEP_INTERVAL, setup_logging)
+from database import (run_user_writer, flush_users, run_stats_refresher, flush_daily_stats,
+                      load_admin_cache, load_settings_cache, load_channel_index,
+                      ensure_indexes, explain_queries, backfill_channel_names, ping, warm_up,
+                      apply_retention)
+from metrics import (render_metrics, timed_handler, API_LATENCY, API_ERRORS, API_RATE, FLOOD_WAITS,
+                     FLOOD_WAIT_SECONDS, ACTIVE_LINKS, DELETE_QUEUE_DEPTH, TASK_LAG)
+from broadcast import BroadcastDispatcher, resume_broadcasts
+from scheduler import LinkRevoker, MessageDeleter
+from link_pool import InviteLinkPool
+from monitor import system_sampler, loop_watchdog, format_perf_report
+from lease import Lease, run_leader_job
+from helper_func import on_bot_member_updated
+from ratelimit import RateLimiter, get_flood_sleep_limit
 import pyrogram.utils
 from aiohttp import web
 
@@ -24,17 +42,96 @@ class Bot(Client):
             plugins={"root": "plugins"},
             workers=TG_BOT_WORKERS,
             bot_token=TG_BOT_TOKEN,
-            sleep_threshold=60,
+            # FloodWaits come back to invoke() so the rate limiter can react
+            sleep_threshold=0,
         )
-        self.LOGGER = LOGGER
+        self.LOGGER = LOGGER(__name__)
+        self.rate_limiter = RateLimiter()
         self.start_time = None
         self.username = None
+        self.link_revoker = LinkRevoker(self)
+        self.link_pool = InviteLinkPool(self)
+        self.broadcast_dispatcher = BroadcastDispatcher(self)
+        # Periodic maintenance runs on one instance only
+        self.maintenance_lease = Lease("maintenance")
+        self.message_deleter = MessageDeleter(self, self.maintenance_lease)
+
+        ACTIVE_LINKS.set_function(fn=lambda: len(self.link_revoker.scheduler))
+        API_RATE.set_function(fn=lambda: self.rate_limiter.bucket.rate)
+        DELETE_QUEUE_DEPTH.set_function(fn=lambda: self.message_deleter.depth)
+        TASK_LAG.set_function("message-deleter", fn=lambda: self.message_deleter.last_lag)
+        TASK_LAG.set_function("link-revoker", fn=lambda: self.link_revoker.scheduler.last_lag)
+        TASK_LAG.set_function("broadcast-dispatcher", fn=lambda: self.broadcast_dispatcher.scheduler.last_lag)
+        TASK_LAG.set_function("event-loop", fn=lambda: loop_watchdog.last_lag)
+
+    async def invoke(self, query, *args, **kwargs):
+        method = type(query).__name__
+        limited = self.rate_limiter.applies_to(query)
+        chat = self.rate_limiter.chat_key(query) if limited else None
+        while True:
+            if limited:
+                await self.rate_limiter.acquire(chat, method)
+            started = time.perf_counter()
+            try:
+                return await super().invoke(query, *args, **kwargs)
+            except FloodWait as e:
+                FLOOD_WAITS.inc(method)
+                FLOOD_WAIT_SECONDS.inc(method, amount=e.value)
+                self.rate_limiter.on_flood_wait(e.value, chat, method)
+                # Callers that handle FloodWait themselves lower the limit
+                if e.value > get_flood_sleep_limit():
+                    raise
+                # Retry once the wait is over; limited calls wait in acquire()
+                if not limited:
+                    await asyncio.sleep(e.value)
+            except RPCError as e:
+                API_ERRORS.inc(method, e.ID or type(e).__name__)
+                raise
+            finally:
+                API_LATENCY.observe(method, value=time.perf_counter() - started)
+
+    def add_handler(self, handler, group: int = 0):
+        # Plugins register through here, so every async handler gets timed
+        if inspect.iscoroutinefunction(handler.callback):
+            handler.callback = timed_handler(handler.callback)
+        return super().add_handler(handler, group)
 
     async def start(self, *args, **kwargs):
         await super().start()
-        usr_bot_me = await self.get_me()
+        # Watch for blocking callbacks from the very start
+        loop_watchdog.start()
+        # Client.start already fetched our own user into self.me
         self.start_time = datetime.now()
-        self.username = usr_bot_me.username
+        self.username = self.me.username
+        # Group -1 so plugin handlers in the default group still see these updates
+        self.add_handler(ChatMemberUpdatedHandler(on_bot_member_updated), group=-1)
+        self.add_handler(MessageHandler(self.perf_command, filters.command("perf") & filters.user(OWNER_ID)), group=-1)
+
+        # Open the connection pool now rather than on the first user request
+        try:
+            latency = await warm_up()
+            self.LOGGER.info(f"Database connected, ping {latency:.1f} ms")
+        except Exception as e:
+            self.LOGGER.error(f"Database warm-up failed: {e}")
+
+        # Make sure every query function is backed by an index
+        indexes = await ensure_indexes()
+        for index, queries in indexes.items():
+            self.LOGGER.info(f"Index {index} covers {', '.join(queries)}")
+        for query, plan in (await explain_queries()).items():
+            if plan.get('collscan'):
+                self.LOGGER.warning(f"{query} still uses a collection scan: {plan['stages']}")
+        # Null names break the (anime_name, _id) cursor of channel listings
+        unnamed = await backfill_channel_names()
+        if unnamed:
+            self.LOGGER.info(f"Gave {unnamed} unnamed channels an empty name")
+
+        # Warm admin cache so filters never hit the database on the first updates
+        admin_count = await load_admin_cache()
+        self.LOGGER.info(f"Loaded {admin_count} admins into cache")
+        await load_settings_cache()
+        channel_count = await load_channel_index()
+        self.LOGGER.info(f"Indexed {channel_count} channels for search")
 
         # Notify owner
         try:
@@ -58,6 +155,8 @@ class Bot(Client):
         # Start web server for potential webhooks
         try:
             app = web.Application()
+            app.router.add_get("/metrics", self.metrics_route)
+            app.router.add_get("/healthz", self.healthz_route)
             runner = web.AppRunner(app)
             await runner.setup()
             site = web.TCPSite(runner, "0.0.0.0", PORT)
@@ -66,24 +165,88 @@ class Bot(Client):
         except Exception as e:
             self.LOGGER.error(f"Web server error: {e}")
 
+        self.maintenance_lease.start()
+
+        # Pick up broadcasts interrupted by the last shutdown
+        resumed = await resume_broadcasts(self)
+        if resumed:
+            self.LOGGER.info(f"Found {resumed} interrupted broadcasts")
+
+        # Start scheduled broadcasts on time and delete their messages later
+        scheduled = await self.broadcast_dispatcher.start()
+        self.LOGGER.info(f"Scheduled {scheduled} broadcast sends and deletions")
+
+        # Revoke temporary links at their exact expiry
+        pending_links = await self.link_revoker.start()
+        self.LOGGER.info(f"Scheduled revocation of {pending_links} temporary links")
+
+        # Auto-delete queued messages, including those queued before a restart
+        queued = await self.message_deleter.start()
+        self.LOGGER.info(f"Message deletion queue holds {queued} entries")
+
+        # Keep pre-minted invite links ready for channels in use
+        orphaned_links = await self.link_pool.start()
+        self.LOGGER.info(f"Invite link pool started, revoking {orphaned_links} links left pooled before")
+
         # Start background tasks
-        asyncio.create_task(self.background_tasks())
+        system_sampler.start()
+        # Revoke expired links no local scheduler knows, e.g. saved by an instance that died
+        asyncio.create_task(run_leader_job(self.maintenance_lease, LINK_SWEEP_INTERVAL, self.sweep_links))
+        asyncio.create_task(run_user_writer())
+        asyncio.create_task(run_stats_refresher())
+        # Take over broadcasts left running by an instance that died
+        asyncio.create_task(run_leader_job(self.maintenance_lease, 60, lambda: resume_broadcasts(self)))
+        # Pick up broadcasts scheduled by other instances since we loaded
+        asyncio.create_task(run_leader_job(self.maintenance_lease, 60, self.broadcast_dispatcher.refresh))
+        # Roll old links into daily summaries and drop long-deleted channels
+        asyncio.create_task(run_leader_job(self.maintenance_lease, RETENTION_INTERVAL, apply_retention))
 
-    async def background_tasks(self):
-        """Run background maintenance tasks"""
-        while True:
-            try:
-                await asyncio.sleep(3600)  # Run every hour
-                # Clean expired data, check system health, etc.
-                pass
-            except Exception as e:
-                self.LOGGER.error(f"Background task error: {e}")
+    async def metrics_route(self, request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    async def healthz_route(self, request):
+        # Loop lag as seen by this request plus the watchdog's latest heartbeat
+        expected = time.monotonic()
+        await asyncio.sleep(0)
+        loop_lag = max(time.monotonic() - expected, loop_watchdog.last_lag)
+        try:
+            db_ok = await asyncio.wait_for(ping(), timeout=2)
+        except asyncio.TimeoutError:
+            db_ok = False
+        healthy = db_ok and loop_lag < HEALTH_MAX_LOOP_LAG
+        return web.json_response(
+            {'status': 'ok' if healthy else 'degraded', 'database': db_ok, 'loop_lag': round(loop_lag, 4)},
+            status=200 if healthy else 503
+        )
+
+    async def perf_command(self, client, message):
+        """Owner-only report of loop lag, slow handlers, slow DB calls and stalls"""
+        await message.reply_text(format_perf_report(), parse_mode=ParseMode.HTML)
+        message.stop_propagation()
+
+    async def sweep_links(self):
+        """Safety net for links the scheduler missed"""
+        missed = await self.link_revoker.sweep()
+        if missed:
+            self.LOGGER.info(f"Revoked {missed} expired links missed by the scheduler")
 
     async def stop(self, *args):
+        await self.maintenance_lease.stop()
+        await self.link_revoker.stop()
+        await self.broadcast_dispatcher.stop()
+        await self.message_deleter.stop()
+        await self.link_pool.stop()
+        await system_sampler.stop()
+        loop_watchdog.stop()
+        written = await flush_users()
+        self.LOGGER.info(f"Flushed {written} buffered users")
+        await flush_daily_stats()
         await super().stop()
         self.LOGGER.info("Bot stopped gracefully")
 
 if __name__ == "__main__":
+    setup_logging()
+
     # Create bot instance
     bot = Bot()
     
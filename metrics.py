@@ -0,0 +1,192 @@
+import bisect
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# ========== METRIC TYPES ==========
+# Minimal Prometheus text-format metrics; enough for counters, gauges and
+# histograms with labels without pulling in another dependency.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Gauge(_Metric):
+    """Gauge whose values are set directly or read from callbacks at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+    def set_function(self, *labels: str, fn: Callable[[], float]):
+        self._functions[labels] = fn
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        values = dict(self._values)
+        for labels, fn in self._functions.items():
+            try:
+                values[labels] = fn()
+            except Exception:
+                continue
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._max: Dict[Tuple, float] = {}
+
+    def observe(self, *labels: str, value: float):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+        if value > self._max.get(labels, 0.0):
+            self._max[labels] = value
+
+    def summary(self) -> List[Dict]:
+        """Count, mean, p95 (bucket upper bound) and max per label set"""
+        rows = []
+        for labels, series in self._values.items():
+            count = series[-1]
+            if not count:
+                continue
+            p95, cumulative = float('inf'), 0
+            for bound, bucket in zip(self.buckets, series):
+                cumulative += bucket
+                if cumulative >= count * 0.95:
+                    p95 = bound
+                    break
+            rows.append({'labels': labels, 'count': count, 'avg': series[-2] / count,
+                         'p95': min(p95, self._max[labels]), 'max': self._max[labels]})
+        return rows
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+def render_metrics() -> str:
+    """Render every registered metric in Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ========== BOT METRICS ==========
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Update handler latency per command", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handlers that raised", ["handler"])
+DB_LATENCY = Histogram("bot_db_operation_seconds", "Latency of database.py functions", ["function"])
+API_LATENCY = Histogram("bot_telegram_api_seconds", "Telegram API call latency", ["method"])
+API_ERRORS = Counter("bot_telegram_api_errors_total", "Telegram API errors", ["method", "error"])
+FLOOD_WAITS = Counter("bot_telegram_flood_waits_total", "FloodWait errors returned by Telegram", ["method"])
+API_QUEUE_WAIT = Histogram("bot_telegram_api_queue_wait_seconds", "Time API calls waited for rate limit budget", ["lane"])
+API_RATE = Gauge("bot_telegram_api_rate", "Current global API call budget per second")
+FLOOD_WAIT_SECONDS = Counter("bot_telegram_flood_wait_seconds_total", "Seconds Telegram asked us to wait", ["method"])
+ACTIVE_LINKS = Gauge("bot_active_temporary_links", "Temporary links waiting to be revoked")
+DELETE_QUEUE_DEPTH = Gauge("bot_delete_queue_depth", "Queued message deletions")
+LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "How late watchdog heartbeats run on the event loop",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = Counter("bot_event_loop_stalls_total", "Times the event loop was blocked past the stall threshold")
+TASK_LAG = Gauge("bot_background_task_lag_seconds", "How late background tasks run", ["task"])
+
+def timed_db(func):
+    """Record latency of a database.py coroutine"""
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_LATENCY.observe(name, value=time.perf_counter() - started)
+    return wrapper
+
+def handler_label(callback, update) -> str:
+    """Label handler metrics by command where there is one"""
+    command = getattr(update, 'command', None)
+    if command:
+        return f"/{command[0]}"
+    return getattr(callback, '__name__', 'handler')
+
+def timed_handler(callback):
+    """Record latency and failures of an update handler coroutine"""
+
+    @wraps(callback)
+    async def wrapper(client, update, *args):
+        started = time.perf_counter()
+        try:
+            return await callback(client, update, *args)
+        except StopAsyncIteration:
+            # StopPropagation/ContinuePropagation are control flow, not failures
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(handler_label(callback, update))
+            raise
+        finally:
+            HANDLER_LATENCY.observe(handler_label(callback, update), value=time.perf_counter() - started)
+    return wrapper
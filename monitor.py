@@ -0,0 +1,217 @@
+import asyncio
+import html
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+import psutil
+from config import (LOGGER, SYSTEM_SAMPLE_INTERVAL, SYSTEM_SAMPLE_HISTORY, WATCHDOG_INTERVAL,
+                    WATCHDOG_STALL_THRESHOLD, WATCHDOG_HISTORY)
+from metrics import LOOP_LAG, LOOP_STALLS, HANDLER_LATENCY, DB_LATENCY
+
+logger = LOGGER(__name__)
+
+# ========== SYSTEM SAMPLER ==========
+def _round(value, scale: float = 1) -> float:
+    """Scale and round a psutil reading; some hosts report None"""
+    return round(value / scale, 1) if value is not None else 0
+
+class SystemSampler:
+    """Sample host and process metrics in the background into a ring buffer.
+
+    Readers only look at the buffer, so a status request never blocks the
+    event loop. Loop lag is how late each sampling sleep wakes up.
+    """
+
+    FIELDS = ('cpu', 'ram', 'disk_percent', 'process_rss', 'open_fds', 'loop_lag_ms')
+
+    def __init__(self, interval: int = SYSTEM_SAMPLE_INTERVAL, history: int = SYSTEM_SAMPLE_HISTORY):
+        self.interval = interval
+        self.samples = deque(maxlen=max(history // interval, 1))
+        self._process = psutil.Process(os.getpid())
+        self._task = None
+
+    def start(self):
+        if not self._task:
+            # First cpu_percent(None) call only sets the baseline
+            psutil.cpu_percent(interval=None)
+            self._process.cpu_percent(interval=None)
+            self.samples.append(self.collect(0.0))
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - expected, 0.0)
+            try:
+                self.samples.append(self.collect(lag))
+            except Exception:
+                pass
+
+    def collect(self, loop_lag: float) -> Dict:
+        """Take one sample without blocking"""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        try:
+            open_fds = self._process.num_fds() or 0
+        except (AttributeError, psutil.Error):
+            open_fds = 0
+        return {
+            'time': time.time(),
+            'cpu': _round(psutil.cpu_percent(interval=None)),
+            'process_cpu': _round(self._process.cpu_percent(interval=None)),
+            'ram': _round(memory.percent),
+            'ram_used': _round(memory.used, 1024**3),  # GB
+            'ram_total': _round(memory.total, 1024**3),  # GB
+            'disk_used': _round(disk.used, 1024**3),  # GB
+            'disk_total': _round(disk.total, 1024**3),  # GB
+            'disk_percent': _round(disk.percent),
+            'process_rss': _round(self._process.memory_info().rss, 1024**2),  # MB
+            'open_fds': open_fds,
+            'loop_lag_ms': round(loop_lag * 1000, 2)
+        }
+
+    def latest(self) -> Optional[Dict]:
+        return self.samples[-1] if self.samples else None
+
+    def summary(self, minutes: int = 5) -> Dict[str, Dict[str, float]]:
+        """Min/avg/max of each field over the last N minutes"""
+        since = time.time() - minutes * 60
+        window = [s for s in self.samples if s['time'] >= since]
+        if not window:
+            return {}
+        summary = {}
+        for field in self.FIELDS:
+            values = [s[field] for s in window]
+            summary[field] = {
+                'min': min(values),
+                'avg': round(sum(values) / len(values), 2),
+                'max': max(values)
+            }
+        return summary
+
+system_sampler = SystemSampler()
+
+# ========== LOOP WATCHDOG ==========
+class LoopWatchdog:
+    """Measure event-loop lag continuously and catch what blocks it.
+
+    A callback on the loop stamps a heartbeat every `interval` and records how
+    late it ran. A separate thread watches the stamp; once it is older than
+    `threshold` the loop is stuck in some callback, and the thread grabs the
+    loop thread's stack at that moment, which points at the blocking code.
+    """
+
+    def __init__(self, interval: float = WATCHDOG_INTERVAL, threshold: float = WATCHDOG_STALL_THRESHOLD,
+                 history: int = WATCHDOG_HISTORY):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=history)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread = None
+        self._handle = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_beat = 0.0
+        self._expected = 0.0
+        self._open_stall: Optional[Dict] = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = self._expected = time.monotonic()
+        self._handle = self._loop.call_soon(self._beat)
+        # Each watcher gets its own event, so one that outlives stop() can't be revived
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(self._stop,), name="loop-watchdog",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = max(now - self._expected, 0.0)
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        LOOP_LAG.observe(value=lag)
+        with self._lock:
+            self._last_beat = now
+            if self._open_stall:
+                # The loop is free again; record how long it was blocked in total
+                self._open_stall['duration'] = now - self._open_stall['started']
+                self._open_stall = None
+        self._expected = now + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            with self._lock:
+                blocked = time.monotonic() - self._last_beat
+                if blocked < self.threshold + self.interval or self._open_stall:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                stall = {'at': datetime.utcnow(), 'started': self._last_beat, 'duration': blocked, 'stack': ''}
+                self.stalls.append(stall)
+                self._open_stall = stall
+            # Format outside the lock; _beat takes it as soon as the loop is free
+            stack = stall['stack'] = ''.join(traceback.format_stack(frame)) if frame else ''
+            LOOP_STALLS.inc()
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f} ms, currently in:\n{stack}")
+
+    def recent_stalls(self, limit: int = 5) -> List[Dict]:
+        return list(self.stalls)[-limit:][::-1]
+
+loop_watchdog = LoopWatchdog()
+
+def _innermost_frame(stack: str) -> str:
+    """Last 'File ..., line N, in func' line of a formatted stack, shortened"""
+    frames = [line.strip() for line in stack.splitlines() if line.strip().startswith('File ')]
+    if not frames:
+        return 'unknown'
+    path, _, rest = frames[-1].partition(', line ')
+    return f"{os.path.basename(path[6:-1])}:{rest}"
+
+def format_perf_report(limit: int = 5) -> str:
+    """Event-loop health, slowest handlers and DB calls, and recent stalls"""
+    lines = ["<b>⚙️ Performance</b>\n",
+             f"<b>🔁 Loop lag:</b> {loop_watchdog.last_lag * 1000:.1f} ms now, "
+             f"{loop_watchdog.max_lag * 1000:.0f} ms max, {len(loop_watchdog.stalls)} stalls recorded"]
+    for title, histogram in (("🐢 Slowest handlers", HANDLER_LATENCY), ("🗄 Slowest DB calls", DB_LATENCY)):
+        rows = sorted(histogram.summary(), key=lambda row: row['p95'], reverse=True)[:limit]
+        lines.append(f"\n<b>{title} (p95):</b>")
+        if not rows:
+            lines.append("  none yet")
+        for row in rows:
+            lines.append(f"  <code>{html.escape(row['labels'][0])}</code> {row['count']}× avg {row['avg'] * 1000:.0f} ms, "
+                         f"p95 ≤{row['p95'] * 1000:.0f} ms, max {row['max'] * 1000:.0f} ms")
+    lines.append("\n<b>🧊 Recent stalls:</b>")
+    stalls = loop_watchdog.recent_stalls(limit)
+    if not stalls:
+        lines.append("  none")
+    for stall in stalls:
+        lines.append(f"  {stall['at'].strftime('%H:%M:%S')} {stall['duration'] * 1000:.0f} ms in "
+                     f"<code>{html.escape(_innermost_frame(stall['stack']))}</code>")
+    return "\n".join(lines)
@@ -0,0 +1,259 @@
+import asyncio
+import contextvars
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional, Tuple
+from pyrogram.errors import FloodWait
+from config import (LOGGER, API_GLOBAL_RATE, API_GLOBAL_BURST, API_USER_RATE, API_GROUP_RATE,
+                    API_CHAT_BURST, API_RATE_RECOVERY, API_FLOOD_SLEEP_THRESHOLD)
+from metrics import API_QUEUE_WAIT
+
+logger = LOGGER(__name__)
+
+# ========== PRIORITY LANES ==========
+# When the global budget is short, lanes are served in this order
+LANES = ('interactive', 'background', 'broadcast')
+
+_current_lane = contextvars.ContextVar('api_lane', default='interactive')
+
+def set_api_lane(lane: str):
+    """Put every Telegram call made by the current task in a lane"""
+    _current_lane.set(lane)
+
+@contextmanager
+def api_lane(lane: str):
+    """Put the Telegram calls made inside the block in a lane"""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+# ========== FLOOD WAIT LIMIT ==========
+_flood_sleep_limit = contextvars.ContextVar('flood_sleep_limit', default=API_FLOOD_SLEEP_THRESHOLD)
+
+def get_flood_sleep_limit() -> int:
+    """Longest FloodWait the current task lets Telegram calls sleep through"""
+    return _flood_sleep_limit.get()
+
+@contextmanager
+def flood_sleep_limit(seconds: int):
+    """Raise FloodWaits longer than `seconds` from calls made inside the block.
+
+    Use 0 for callers that handle FloodWait themselves, e.g. to fail open or
+    to reschedule instead of waiting.
+    """
+    token = _flood_sleep_limit.set(min(seconds, API_FLOOD_SLEEP_THRESHOLD))
+    try:
+        yield
+    finally:
+        _flood_sleep_limit.reset(token)
+
+# ========== TOKEN BUCKET ==========
+class TokenBucket:
+    """Classic token bucket that can also be paused (e.g. after a FloodWait)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> bool:
+        if self.delay(now) > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    @property
+    def idle(self) -> bool:
+        return self.tokens >= self.capacity and time.monotonic() >= self.paused_until
+
+# ========== RATE LIMITER ==========
+# Only these namespaces cost Telegram budget worth coordinating; updates,
+# auth and help calls made by Pyrogram itself pass straight through.
+LIMITED_NAMESPACES = {'messages', 'channels'}
+# Methods that post into a chat and so also count against that chat's budget
+CHAT_METHODS = {'SendMessage', 'SendMedia', 'SendMultiMedia', 'ForwardMessages', 'EditMessage'}
+MAX_CHAT_BUCKETS = 10000
+
+ChatKey = Tuple[str, int]
+
+class RateLimiter:
+    """Global and per-chat budgets for outgoing Telegram API calls.
+
+    Every limited call takes a token from its chat's bucket (when it posts
+    into a chat) and then from the global bucket. Callers short of a global
+    token queue in their lane and the pump hands tokens to the highest
+    priority lane first. A FloodWait pauses the chat that hit it (or the
+    method, for calls not aimed at a chat) and cuts the global rate; the
+    rate creeps back to API_GLOBAL_RATE once no FloodWait has been seen for
+    API_RATE_RECOVERY seconds. A caller that would have to wait out a pause
+    longer than its flood_sleep_limit gets the FloodWait straight away.
+    """
+
+    def __init__(self, rate: float = API_GLOBAL_RATE, burst: float = API_GLOBAL_BURST):
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self._chats: Dict[ChatKey, TokenBucket] = {}
+        self._queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._method_paused_until: Dict[str, float] = {}
+        self._pump_task: Optional[asyncio.Task] = None
+        self._last_flood = 0.0
+        self._last_recovery = 0.0
+        self._namespaces: Dict[type, bool] = {}
+        self.waits = {lane: {'calls': 0, 'waited': 0, 'total': 0.0, 'max': 0.0} for lane in LANES}
+        self.flood_waits = 0
+
+    def applies_to(self, query) -> bool:
+        cls = type(query)
+        limited = self._namespaces.get(cls)
+        if limited is None:
+            # e.g. pyrogram.raw.functions.messages.send_message
+            parts = cls.__module__.split('.')
+            limited = self._namespaces[cls] = len(parts) > 3 and parts[3] in LIMITED_NAMESPACES
+        return limited
+
+    @staticmethod
+    def chat_key(query) -> Optional[ChatKey]:
+        if type(query).__name__ not in CHAT_METHODS:
+            return None
+        peer = getattr(query, 'peer', None) or getattr(query, 'to_peer', None)
+        for attr in ('user_id', 'channel_id', 'chat_id'):
+            peer_id = getattr(peer, attr, None)
+            if peer_id is not None:
+                return attr, peer_id
+        return None
+
+    async def acquire(self, chat: Optional[ChatKey] = None, method: Optional[str] = None):
+        """Wait for budget to make one call from the current lane"""
+        lane = _current_lane.get()
+        started = time.monotonic()
+        if chat is not None:
+            await self._acquire_chat(chat)
+        elif method is not None:
+            await self._wait_out(self._method_paused_until.get(method, 0.0))
+        await self._acquire_global(lane)
+        self._record_wait(lane, time.monotonic() - started)
+
+    def on_flood_wait(self, seconds: float, chat: Optional[ChatKey] = None, method: Optional[str] = None):
+        """Back off after Telegram answered FloodWait to a call to `chat` or of `method`"""
+        now = time.monotonic()
+        self.flood_waits += 1
+        if chat is not None:
+            self._chat_bucket(chat).pause(seconds)
+        elif method is not None:
+            self._method_paused_until[method] = max(self._method_paused_until.get(method, 0.0), now + seconds)
+        self.bucket.rate = max(1.0, self.bucket.rate * 0.7)
+        self._last_flood = now
+        logger.warning(f"FloodWait {seconds}s on {method or chat}, global rate now {self.bucket.rate:.1f}/s")
+
+    def stats(self) -> Dict:
+        """Current rate and queue wait per lane"""
+        return {
+            'rate': round(self.bucket.rate, 2),
+            'flood_waits': self.flood_waits,
+            'chats': len(self._chats),
+            'lanes': {lane: {'queued': len(self._queues[lane]),
+                             'avg_wait': round(w['total'] / w['calls'], 4) if w['calls'] else 0,
+                             'max_wait': round(w['max'], 4),
+                             'waited': w['waited'],
+                             'calls': w['calls']}
+                      for lane, w in self.waits.items()}
+        }
+
+    def _record_wait(self, lane: str, waited: float):
+        stats = self.waits[lane]
+        stats['calls'] += 1
+        stats['total'] += waited
+        stats['max'] = max(stats['max'], waited)
+        if waited > 0.001:
+            stats['waited'] += 1
+        API_QUEUE_WAIT.observe(lane, value=waited)
+
+    def _chat_bucket(self, chat: ChatKey) -> TokenBucket:
+        bucket = self._chats.get(chat)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle}
+            rate = API_USER_RATE if chat[0] == 'user_id' else API_GROUP_RATE
+            bucket = self._chats[chat] = TokenBucket(rate, API_CHAT_BURST)
+        return bucket
+
+    @staticmethod
+    async def _wait_out(paused_until: float):
+        delay = paused_until - time.monotonic()
+        if delay <= 0:
+            return
+        if delay > _flood_sleep_limit.get():
+            raise FloodWait(value=math.ceil(delay))
+        await asyncio.sleep(delay)
+
+    async def _acquire_chat(self, chat: ChatKey):
+        bucket = self._chat_bucket(chat)
+        await self._wait_out(bucket.paused_until)
+        while not bucket.take(time.monotonic()):
+            await asyncio.sleep(bucket.delay(time.monotonic()))
+
+    async def _acquire_global(self, lane: str):
+        now = time.monotonic()
+        self._recover(now)
+        if not any(self._queues.values()) and self.bucket.take(now):
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[lane].append(waiter)
+        if not self._pump_task:
+            self._pump_task = asyncio.create_task(self._pump())
+        await waiter
+
+    def _recover(self, now: float):
+        if (self.bucket.rate < self.rate and now - self._last_flood > API_RATE_RECOVERY
+                and now - self._last_recovery > API_RATE_RECOVERY / 10):
+            self.bucket.rate = min(self.rate, self.bucket.rate + self.rate * 0.1)
+            self._last_recovery = now
+
+    def _next_lane(self) -> Optional[str]:
+        """Highest priority lane with a live waiter"""
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and queue[0].done():
+                queue.popleft()
+            if queue:
+                return lane
+        return None
+
+    async def _pump(self):
+        try:
+            while True:
+                lane = self._next_lane()
+                if lane is None:
+                    return
+                now = time.monotonic()
+                delay = self.bucket.delay(now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                self.bucket.take(now)
+                self._queues[lane].popleft().set_result(None)
+        finally:
+            self._pump_task = None
@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple, Union
+from pyrogram.errors import FloodWait
+from config import (LOGGER, LINK_REVOKE_CONCURRENCY, INSTANCE_ID, DELETE_QUEUE_POLL_INTERVAL,
+                    DELETE_QUEUE_BATCH, DELETE_QUEUE_CONCURRENCY)
+from database import (add_link_listener, get_active_links, get_expired_links, claim_link,
+                      mark_link_revoked, queue_message_deletion, get_due_deletions,
+                      get_next_deletion_time, remove_deletions, count_queued_deletions)
+from ratelimit import set_api_lane, flood_sleep_limit
+
+logger = LOGGER(__name__)
+
+DueHandler = Callable[[List[Tuple[Hashable, Any]]], Awaitable[None]]
+
+# MessageDeleter waits at least this long when a pass makes no progress, and
+# backs off exponentially (up to the maximum) while drain() keeps failing
+DELETE_QUEUE_MIN_SLEEP = 1
+DELETE_QUEUE_MAX_BACKOFF = 60
+
+def to_timestamp(when: Union[datetime, float, int]) -> float:
+    """Convert a naive UTC datetime (as stored in Mongo) to a Unix timestamp"""
+    if isinstance(when, datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return when.timestamp()
+    return float(when)
+
+# ========== DEADLINE SCHEDULER ==========
+class DeadlineScheduler:
+    """Run a handler for keyed items at their deadlines.
+
+    All pending items live in one min-heap served by a single task, which sleeps
+    until the earliest deadline and hands every item due at that point to the
+    handler as one batch. Rescheduling or cancelling a key leaves a stale heap
+    entry behind that is skipped when popped.
+    """
+
+    def __init__(self, handler: DueHandler, name: str = "scheduler"):
+        self.handler = handler
+        self.name = name
+        self._heap: List[Tuple[float, int, Hashable, Any]] = []
+        self._current: Dict[Hashable, int] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.fired = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._current
+
+    def schedule(self, key: Hashable, deadline: Union[datetime, float], payload: Any = None):
+        """Add or move an item; the handler gets (key, payload) once deadline passes"""
+        deadline = to_timestamp(deadline)
+        seq = next(self._counter)
+        self._current[key] = seq
+        heapq.heappush(self._heap, (deadline, seq, key, payload))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        """Forget a pending item"""
+        return self._current.pop(key, None) is not None
+
+    def next_deadline(self) -> float:
+        """Timestamp of the earliest pending item, or 0 if idle"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else 0.0
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _discard_stale(self):
+        while self._heap and self._current.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: float) -> List[Tuple[Hashable, Any]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, seq, key, payload = heapq.heappop(self._heap)
+            if self._current.get(key) != seq:
+                continue
+            del self._current[key]
+            self.last_lag = now - deadline
+            self.max_lag = max(self.max_lag, self.last_lag)
+            due.append((key, payload))
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._discard_stale()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = self._pop_due(time.time())
+            if not due:
+                continue
+            self.fired += len(due)
+            try:
+                await self.handler(due)
+            except Exception as e:
+                logger.error(f"{self.name} handler error: {e}")
+
+# ========== LINK REVOCATION ==========
+class LinkRevoker:
+    """Revoke temporary invite links exactly at their expiry"""
+
+    def __init__(self, client, concurrency: int = LINK_REVOKE_CONCURRENCY):
+        self.client = client
+        self.scheduler = DeadlineScheduler(self._revoke_due, name="link-revoker")
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.revoked = 0
+        self.failed = 0
+
+    async def start(self) -> int:
+        """Load every active link from the database and start the scheduler"""
+        # Links saved from now on are scheduled as soon as they are written
+        add_link_listener(self.schedule)
+        for link in await get_active_links():
+            self.schedule(link['_id'], link['channel_id'], link['invite_link'], link['expires_at'])
+        self.scheduler.start()
+        return len(self.scheduler)
+
+    async def stop(self):
+        await self.scheduler.stop()
+
+    def schedule(self, link_id: str, channel_id: int, invite_link: str, expires_at: datetime):
+        """Revoke a link at expires_at"""
+        self.scheduler.schedule(link_id, expires_at, (channel_id, invite_link))
+
+    async def sweep(self) -> int:
+        """Revoke expired links the scheduler doesn't know about (e.g. saved elsewhere)"""
+        missed = [(link['_id'], (link['channel_id'], link['invite_link']))
+                  for link in await get_expired_links()
+                  if link['_id'] not in self.scheduler]
+        if missed:
+            await self._revoke_due(missed)
+        return len(missed)
+
+    async def _revoke_due(self, due: List[Tuple[str, Tuple[int, str]]]):
+        await asyncio.gather(*(self._revoke(link_id, channel_id, invite_link)
+                               for link_id, (channel_id, invite_link) in due))
+
+    async def _revoke(self, link_id: str, channel_id: int, invite_link: str):
+        set_api_lane('background')
+        async with self._semaphore:
+            # Every instance schedules every link; the claim picks one to revoke it
+            if not await claim_link(link_id, INSTANCE_ID):
+                return
+            try:
+                # A FloodWait must come back here to be rescheduled, not slept through
+                with flood_sleep_limit(0):
+                    await self.client.revoke_chat_invite_link(channel_id, invite_link)
+                self.revoked += 1
+            except FloodWait as e:
+                # Retry from the heap rather than sleeping here, which would
+                # hold up every other revocation due in this batch
+                self.scheduler.schedule(link_id, time.time() + e.value + 1, (channel_id, invite_link))
+                return
+            except Exception as e:
+                # Link already gone or bot lost rights; nothing left to retry
+                logger.warning(f"Failed to revoke link {link_id} in {channel_id}: {e}")
+                self.failed += 1
+            await mark_link_revoked(link_id)
+
+# ========== MESSAGE AUTO-DELETE ==========
+async def delete_chat_messages(client, chat_id: int, message_ids: List[int]) -> int:
+    """Delete messages from one chat in as few calls as possible"""
+    deleted = 0
+    # delete_messages takes at most 100 IDs per call
+    for start in range(0, len(message_ids), 100):
+        batch = message_ids[start:start + 100]
+        while True:
+            try:
+                deleted += await client.delete_messages(chat_id, batch)
+                break
+            except FloodWait as e:
+                await asyncio.sleep(e.value + 1)
+            except Exception:
+                # Chat gone, bot blocked or messages too old to delete
+                break
+    return deleted
+
+class MessageDeleter:
+    """Delete messages later, from a queue persisted in Mongo.
+
+    Any instance can queue a deletion. Only the holder of `lease` drains the
+    queue: it sleeps until the earliest entry is due (at most
+    DELETE_QUEUE_POLL_INTERVAL, to notice entries queued elsewhere) and groups
+    everything due by chat into delete_messages calls. Nothing waits in memory,
+    so a restart loses no pending deletions.
+    """
+
+    def __init__(self, client, lease, concurrency: int = DELETE_QUEUE_CONCURRENCY):
+        self.client = client
+        self.lease = lease
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._next_at = 0.0
+        self._task = None
+        self.depth = 0
+        self.deleted = 0
+        self.last_lag = 0.0
+
+    async def start(self) -> int:
+        """Start draining; returns the number of queued entries"""
+        self.depth = await count_queued_deletions()
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+        return self.depth
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def queue(self, chat_id: int, message_ids: List[int], seconds: int) -> bool:
+        """Delete message_ids from chat_id after `seconds`"""
+        delete_at = datetime.utcnow() + timedelta(seconds=seconds)
+        queued = await queue_message_deletion(chat_id, message_ids, delete_at)
+        if queued:
+            self.depth += 1
+            if to_timestamp(delete_at) < self._next_at:
+                self._wakeup.set()
+        return queued
+
+    async def drain(self) -> int:
+        """Delete one batch of due messages, returns the number of queue entries handled"""
+        entries = await get_due_deletions(DELETE_QUEUE_BATCH)
+        if not entries:
+            return 0
+        self.last_lag = time.time() - to_timestamp(entries[0]['delete_at'])
+        by_chat: Dict[int, List[int]] = {}
+        for entry in entries:
+            by_chat.setdefault(entry['chat_id'], []).extend(entry['message_ids'])
+        await asyncio.gather(*(self._delete(chat_id, message_ids) for chat_id, message_ids in by_chat.items()))
+        if not await remove_deletions([entry['_id'] for entry in entries]):
+            # The same entries are still due; report no progress so _run backs off
+            logger.warning(f"Could not remove {len(entries)} handled deletions from the queue")
+            return 0
+        return len(entries)
+
+    async def _delete(self, chat_id: int, message_ids: List[int]):
+        async with self._semaphore:
+            self.deleted += await delete_chat_messages(self.client, chat_id, message_ids)
+
+    async def _run(self):
+        set_api_lane('background')
+        errors = 0
+        while True:
+            self._wakeup.clear()
+            timeout = DELETE_QUEUE_POLL_INTERVAL
+            try:
+                if self.lease.is_held:
+                    handled = await self.drain()
+                    errors = 0
+                    if handled >= DELETE_QUEUE_BATCH:
+                        continue
+                    self.depth = await count_queued_deletions()
+                    next_at = await get_next_deletion_time()
+                    if next_at:
+                        timeout = min(timeout, max(to_timestamp(next_at) - time.time(), 0))
+                    if not handled:
+                        # Entries that are due but could not be handled must not spin the loop
+                        timeout = max(timeout, DELETE_QUEUE_MIN_SLEEP)
+            except Exception as e:
+                errors += 1
+                timeout = min(DELETE_QUEUE_MIN_SLEEP * 2 ** errors, DELETE_QUEUE_MAX_BACKOFF)
+                logger.error(f"Message deleter error, retrying in {timeout}s: {e}")
+            self._next_at = time.time() + timeout
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,128 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set
+
+# Letters and digits of any script are kept, so CJK or Cyrillic names index too
+_NON_WORD = re.compile(r'[\W_]+')
+
+def normalize(text: str) -> str:
+    """Casefold, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return _NON_WORD.sub(' ', text).strip()
+
+def trigrams(normalized: str) -> Set[str]:
+    """Trigrams of each token, padded so short tokens and word edges count"""
+    grams = set()
+    for token in normalized.split():
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+# ========== CHANNEL SEARCH INDEX ==========
+class ChannelSearchIndex:
+    """In-memory trigram index over active channel names.
+
+    Candidates are gathered from trigram postings and ranked by Dice
+    similarity, so small typos still match, with bonuses for exact, prefix
+    and substring matches. If no candidate scores, names are scanned for the
+    query as a substring, which catches matches inside the long unspaced
+    tokens of scripts such as Japanese.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._docs: Dict[int, Dict] = {}
+        self._names: Dict[int, str] = {}
+        self._grams: Dict[int, Set[str]] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def build(self, channels: Iterable[Dict]):
+        """Replace the index contents with the given channel documents"""
+        self._docs.clear()
+        self._names.clear()
+        self._grams.clear()
+        self._postings.clear()
+        for channel in channels:
+            self.add(channel)
+        self.loaded = True
+
+    def add(self, channel: Dict):
+        """Index or re-index a channel document"""
+        channel_id = channel['_id']
+        self.remove(channel_id)
+        name = normalize(channel.get('anime_name', ''))
+        grams = trigrams(name)
+        self._docs[channel_id] = dict(channel)
+        self._names[channel_id] = name
+        self._grams[channel_id] = grams
+        for gram in grams:
+            self._postings[gram].add(channel_id)
+
+    def remove(self, channel_id: int) -> bool:
+        """Drop a channel from the index"""
+        if channel_id not in self._docs:
+            return False
+        for gram in self._grams.pop(channel_id):
+            posting = self._postings[gram]
+            posting.discard(channel_id)
+            if not posting:
+                del self._postings[gram]
+        del self._docs[channel_id]
+        del self._names[channel_id]
+        return True
+
+    def update(self, channel_id: int, fields: Dict):
+        """Update stored fields of an indexed channel"""
+        if channel_id not in self._docs:
+            return
+        if 'anime_name' in fields:
+            self.add({**self._docs[channel_id], **fields})
+        else:
+            self._docs[channel_id].update(fields)
+
+    def search(self, query: str, limit: int = None, min_score: float = 0.3) -> List[Dict]:
+        """Channels matching query, best first"""
+        query = normalize(query)
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        counts = Counter()
+        for gram in query_grams:
+            posting = self._postings.get(gram)
+            if posting:
+                counts.update(posting)
+
+        tokens = query.split()
+        # Exact/prefix/substring matches share at least half of the query
+        # trigrams, so weaker candidates are ranked on similarity alone
+        bonus_threshold = len(query_grams) / 2
+        scored = []
+        for channel_id, common in counts.items():
+            name = self._names[channel_id]
+            score = 2 * common / (len(query_grams) + len(self._grams[channel_id]))
+            if common >= bonus_threshold:
+                if name == query:
+                    score += 1.0
+                elif name.startswith(query):
+                    score += 0.5
+                elif query in name:
+                    score += 0.3
+                elif all(any(word.startswith(token) for word in name.split()) for token in tokens):
+                    score += 0.2
+            if score >= min_score:
+                scored.append((-score, name, channel_id))
+
+        if not scored:
+            scored = [(0, name, channel_id) for channel_id, name in self._names.items() if query in name]
+
+        scored.sort()
+        if limit:
+            scored = scored[:limit]
+        # Copies, so callers can't alter the indexed documents
+        return [dict(self._docs[channel_id]) for _, _, channel_id in scored]